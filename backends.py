@@ -0,0 +1,378 @@
+import os
+import time
+import uuid
+import zlib
+import warnings
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import reapy
+import reapy.reascript_api as RPR
+
+from reaper_helpers import get_fx_envelopes, set_envelope_points, copy_DI_reapy, loop_DI_item, get_clip_len, \
+    connect_instance, wait_for_stable_output
+from cache_helpers import looped_di_file
+from file_helpers import file_digest
+from wav_helpers import read_wav_info, read_wav_frames, encode_frames, write_wav_header
+
+
+class RenderBackend:
+    """
+    The host that runs audio through an FX.
+
+    A render places the (looped) media on a track, loads the FX on that
+    track, sets the FX's default values, programs each swept parameter as
+    a stepped envelope and renders the result to a file, in that order.
+    A session reuses the loaded FX for later renders: clear() swaps out
+    just the media and envelopes, before placing the next media.
+    """
+
+    # The (FX, defaults) set up by the last reset, while a session is reused
+    session = None
+
+    def measure(self, media_file: Path) -> float:
+        """
+        Returns the length in seconds of the media as placed on a track
+        """
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """
+        Removes all tracks, and therefore their media, FX and envelopes
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """
+        Removes the media and returns every programmed envelope to its
+        default value, keeping the loaded FX
+        """
+        raise NotImplementedError
+
+    def place_media(self, media_file: Path, times: int=1, margin: float=0.0) -> None:
+        """
+        Replaces the media on the track with media_file, repeated times
+        times, each repetition preceded by margin seconds of silence
+        """
+        raise NotImplementedError
+
+    def load_fx(self, fx_name: str) -> None:
+        raise NotImplementedError
+
+    def set_defaults(self, values: Dict[str, float]) -> List[str]:
+        """
+        Sets FX parameters by name, and returns the names that could not be set
+        """
+        raise NotImplementedError
+
+    def program_envelopes(self, columns: Sequence[str], times: Sequence[float], values: np.ndarray) -> List[str]:
+        """
+        Programs the envelope of each parameter in columns to step to the
+        matching column of values (one row per time), and returns the names
+        of the parameters the FX has
+        """
+        raise NotImplementedError
+
+    def render(self, output_file: Optional[Path]=None) -> Path:
+        """
+        Renders the track to output_file (by default a new, uniquely named
+        file in the render directory) and returns the rendered file
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def connect(port: int, render_dir: Path) -> None:
+        """
+        Connects a pool worker process to the instance listening on port
+        """
+        raise NotImplementedError
+
+
+class ReaperBackend(RenderBackend):
+    """
+    Renders in a running REAPER instance via reapy
+    """
+
+    def __init__(self, render_dir: Path, copy_method: str='reapy', di_cache_dir: Optional[Path]=None,
+                 schema_cache_dir: Optional[Path]=None, max_vst_params: int=-1, warmup_time: float=0,
+                 warmup_mode: str='fixed', di_cache_bytes: Optional[int]=None):
+        self.project = reapy.Project()
+        self.render_dir = render_dir
+        self.copy_method = copy_method
+        self.di_cache_dir = di_cache_dir
+        self.di_cache_bytes = di_cache_bytes
+        self.di_digests: Dict[Path, str] = dict()
+        self.schema_cache_dir = schema_cache_dir
+        self.max_vst_params = max_vst_params
+        self.warmup_time = warmup_time
+        self.warmup_mode = warmup_mode
+        self.fx_number = 0
+        self.defaults: Dict[str, float] = dict()
+        self.envelopes: Dict[str, str] = dict()
+        self.warmed_up = False
+
+    def measure(self, media_file: Path) -> float:
+        return get_clip_len(media_file, self.project)
+
+    def reset(self) -> None:
+        for track in self.project.tracks:
+            track.delete()
+        self.project.cursor_position = 0
+        self.session = None
+        self.defaults = dict()
+        self.envelopes = dict()
+        # A newly loaded FX needs warming up again
+        self.warmed_up = False
+
+    def clear(self) -> None:
+        with reapy.inside_reaper():
+            for item in self.project.tracks[0].items:
+                item.delete()
+            for name, envelope in self.envelopes.items():
+                # Drop the previous unit's automation, then hold the default (if any)
+                RPR.DeleteEnvelopePointRange(envelope, -1.0, 1e12)
+                if name in self.defaults:
+                    set_envelope_points(envelope, [0.0], [self.defaults[name]])
+        self.project.cursor_position = 0
+
+    def place_media(self, media_file: Path, times: int=1, margin: float=0.0) -> None:
+        if self.project.n_tracks > 0:
+            for item in self.project.tracks[0].items:
+                item.delete()
+        copy_method = self.copy_method
+        if copy_method == "loop" and not self.loopable(media_file, margin):
+            warnings.warn(f"A margin of {margin}s is not a whole number of frames of {media_file}, "
+                          f"so it is tiled rather than looped to keep clips aligned")
+            copy_method = "tile"
+        if copy_method == "loop":
+            # insert the margin-padded DI once, as a looping item
+            loop_DI_item(self.project, self.looped_di(media_file, 1, margin), times)
+        elif copy_method in ("tile", "sox"):
+            # insert one long DI, tiled in process (and cached across sweeps)
+            self.project.cursor_position = 0
+            RPR.InsertMedia(str(self.looped_di(media_file, times, margin).resolve()), 0)
+        else:
+            # copy via Reapy
+            copy_DI_reapy(self.project,
+                          media_file,
+                          times=times,
+                          margin=margin)
+
+    def looped_di(self, media_file: Path, times: int, margin: float) -> Path:
+        if media_file not in self.di_digests:
+            self.di_digests[media_file] = file_digest(media_file)
+        return looped_di_file(media_file, times, margin, self.di_cache_dir,
+                              di_digest=self.di_digests[media_file], max_bytes=self.di_cache_bytes)
+
+    @staticmethod
+    def loopable(media_file: Path, margin: float) -> bool:
+        """
+        Whether a looping item repeats the DI with exactly clip_len + margin
+        spacing, i.e. the margin is a whole number of frames
+        """
+        frames = margin * read_wav_info(media_file).sample_rate
+        return abs(frames - round(frames)) < 1e-6
+
+    def load_fx(self, fx_name: str) -> None:
+        fx = self.project.tracks[0].add_fx(fx_name)
+        fx.open_ui()
+
+    def set_defaults(self, values: Dict[str, float]) -> List[str]:
+        plist = self.project.tracks[0].fxs[self.fx_number].params
+        failed = []
+        for pname, pvalue in values.items():
+            try:
+                plist[pname] = pvalue
+                self.defaults[pname] = pvalue
+            except:
+                failed.append(pname)
+        return failed
+
+    def program_envelopes(self, columns: Sequence[str], times: Sequence[float], values: np.ndarray) -> List[str]:
+        name2env = get_fx_envelopes(self.project.tracks[0],
+                                    list(columns),
+                                    self.fx_number,
+                                    threshold=self.max_vst_params,
+                                    schema_cache_dir=self.schema_cache_dir)
+        self.envelopes.update(name2env)
+        times = list(times)
+        for param_name, param_vals in zip(columns, np.asarray(values).T):
+            if param_name in name2env:
+                set_envelope_points(name2env[param_name], times, param_vals.tolist())
+        return list(name2env.keys())
+
+    def render(self, output_file: Optional[Path]=None) -> Path:
+        # Warmup / required to fix audio glitch at the start of
+        # recording in some environments.  Only needed once per loaded FX.
+        if self.warmup_time > 0 and not self.warmed_up:
+            self.project.cursor_position = 0
+            self.project.play()
+            if self.warmup_mode == 'stable':
+                wait_for_stable_output(self.project.tracks[0], self.warmup_time)
+            else:
+                time.sleep(self.warmup_time)
+            self.project.pause()
+            self.project.cursor_position = 0
+            self.warmed_up = True
+        # Point the project's render settings at the exact file to read back
+        if output_file is None:
+            output_file = self.render_dir / f"render-{uuid.uuid4().hex[:16]}.wav"
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        self.project.set_info_string("RENDER_FILE", str(output_file.parent.resolve()))
+        self.project.set_info_string("RENDER_PATTERN", output_file.stem)
+        RPR.Main_OnCommand(42230, 0)
+        if not output_file.is_file():
+            raise FileNotFoundError(f"REAPER did not render {output_file}; check that the project renders .wav files")
+        return output_file
+
+    connect = staticmethod(connect_instance)
+
+
+class OfflineBackend(RenderBackend):
+    """
+    An in-process stand-in for REAPER and the FX, for running, profiling
+    and load-testing the pipeline without either.
+
+    The "FX" is a deterministic function of its parameter values: a
+    first-difference tone control followed by tanh saturation, whose
+    amounts are fixed weightings (derived from each parameter's name) of
+    the current values.  Renders have the layout and sample format REAPER
+    would produce for the looped media, so splitting and indexing work on
+    them unchanged.
+    """
+
+    def __init__(self, render_dir: Path):
+        self.render_dir = render_dir
+        self.frames: Dict[Path, np.ndarray] = dict()
+        self.reset()
+
+    def measure(self, media_file: Path) -> float:
+        return read_wav_info(media_file).duration
+
+    def reset(self) -> None:
+        self.session = None
+        self.fx_name = None
+        self.defaults: Dict[str, float] = dict()
+        self.clear()
+
+    def clear(self) -> None:
+        self.media = None
+        self.times = 0
+        self.margin = 0.0
+        self.columns: List[str] = []
+        self.point_times = np.zeros(0)
+        self.point_values = np.zeros((0, 0))
+
+    def place_media(self, media_file: Path, times: int=1, margin: float=0.0) -> None:
+        self.media, self.times, self.margin = Path(media_file), times, margin
+
+    def load_fx(self, fx_name: str) -> None:
+        self.fx_name = fx_name
+
+    def set_defaults(self, values: Dict[str, float]) -> List[str]:
+        self.defaults.update(values)
+        return []
+
+    def program_envelopes(self, columns: Sequence[str], times: Sequence[float], values: np.ndarray) -> List[str]:
+        self.columns = list(columns)
+        self.point_times = np.asarray(times, dtype=np.float64)
+        self.point_values = np.asarray(values, dtype=np.float64).reshape(len(self.point_times), len(self.columns))
+        return list(self.columns)
+
+    def render(self, output_file: Optional[Path]=None) -> Path:
+        info = read_wav_info(self.media)
+        if self.media not in self.frames:
+            self.frames[self.media] = read_wav_frames(self.media)
+        di = self.frames[self.media]
+        sr = info.sample_rate
+        period = info.duration + self.margin
+        n_frames = max(round(self.times * period * sr),
+                       round(((self.times - 1) * period + self.margin) * sr) + len(di) if self.times else 0)
+
+        # The parameter values in effect while each repetition plays
+        names = sorted(set(self.defaults) | set(self.columns))
+        params = np.tile(np.array([self.defaults.get(n, 0.0) for n in names]), (self.times, 1))
+        if self.columns and len(self.point_times):
+            starts = np.arange(self.times) * period + self.margin
+            rows = np.searchsorted(self.point_times, starts, side='right') - 1
+            has_point = rows >= 0
+            for j, name in enumerate(self.columns):
+                params[has_point, names.index(name)] = self.point_values[rows[has_point], j]
+        weights = np.array([self._weights(n) for n in names]).reshape(-1, 2)
+
+        if output_file is None:
+            self.render_dir.mkdir(parents=True, exist_ok=True)
+            fd, output_file = tempfile.mkstemp(prefix="render-", suffix=".wav", dir=self.render_dir)
+            os.close(fd)
+        output_file = Path(output_file)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, "wb") as out:
+            write_wav_header(out, info.fmt_chunk, n_frames * info.block_align)
+            written = 0
+            for i in range(self.times):
+                start = max(round((i * period + self.margin) * sr), written)
+                clip = self._process(di, params[i], weights)[:max(n_frames - start, 0)]
+                out.write(bytes((start - written) * info.block_align))
+                out.write(encode_frames(clip, info))
+                written = start + len(clip)
+            out.write(bytes((n_frames - written) * info.block_align))
+            if (n_frames * info.block_align) % 2:
+                out.write(b'\x00')
+        return output_file
+
+    @staticmethod
+    def _weights(name: str):
+        # Fixed drive and tone weights in [0, 1] per parameter name
+        h = zlib.crc32(name.encode())
+        return (h & 0xFFFF) / 0xFFFF, (h >> 16) / 0xFFFF
+
+    @staticmethod
+    def _process(frames: np.ndarray, values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        drive, tone = 1.0, 0.0
+        if len(values):
+            values = np.clip(values, 0.0, 1.0)
+            drive = 1.0 + 9.0 * np.dot(values, weights[:, 0]) / max(weights[:, 0].sum(), 1e-9)
+            tone = 2.0 * np.dot(values, weights[:, 1]) / max(weights[:, 1].sum(), 1e-9) - 1.0
+        diff = np.diff(frames, axis=0, prepend=frames[:1])
+        shaped = frames + 0.5 * tone * diff
+        return (np.tanh(drive * shaped) / np.tanh(drive)).astype(np.float32)
+
+    @staticmethod
+    def connect(port: int, render_dir: Path) -> None:
+        pass
+
+
+# Render backends by name, as chosen with --backend
+BACKENDS = {'reaper': ReaperBackend, 'offline': OfflineBackend}
+
+
+def di_cache(args) -> Tuple[Path, Optional[int]]:
+    """
+    The directory and size limit of the looped DI cache.  Without
+    --di_cache_dir, looped DIs are not kept: each instance keeps only the
+    one in use, in its own render directory.  With it, the cache is shared
+    and kept within --di_cache_mb, if given.
+    """
+    if args.di_cache_dir is None:
+        return args.reaper_dir / "di_cache", 0
+    return args.di_cache_dir, int(args.di_cache_mb * 2 ** 20) if args.di_cache_mb > 0 else None
+
+
+def make_backend(args) -> RenderBackend:
+    """
+    Creates the render backend chosen by args.backend, rendering into args.reaper_dir
+    """
+    if args.backend == 'offline':
+        return OfflineBackend(args.reaper_dir)
+    di_cache_dir, di_cache_bytes = di_cache(args)
+    return ReaperBackend(args.reaper_dir,
+                         copy_method=args.copy_method,
+                         di_cache_dir=di_cache_dir,
+                         di_cache_bytes=di_cache_bytes,
+                         schema_cache_dir=args.schema_cache_dir,
+                         max_vst_params=args.max_vst_params,
+                         warmup_time=args.warmup_time,
+                         warmup_mode=args.warmup_mode)
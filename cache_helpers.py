@@ -0,0 +1,198 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from index_helpers import SettingsIndex
+from wav_helpers import read_wav_info, tile_wav, concat_wavs
+from file_helpers import file_digest, clip_path
+from encoding_helpers import ClipEncoding
+from utils import write_atomic
+
+
+class RenderCache:
+    """
+    A content-addressed cache of rendered clips.
+
+    Each clip is keyed by a hash of the render context (VST name, defaults,
+    DI content, margin, sample rate and clip encoding) and its full parameter vector, so
+    a setting that was already rendered, earlier in this run or in a
+    previous run, can be linked into place instead of rendered again.
+    Clips are stored under cache_dir by hardlink (or copy, across devices).
+    Without a cache_dir, only settings repeated within the run are reused.
+    """
+
+    def __init__(self, cache_dir: Optional[Path], vst_name: str, default_values: Dict[str, float],
+                 di_digest: str, margin: float, sample_rate: int, encoding: Optional[ClipEncoding]=None):
+        self.cache_dir = cache_dir
+        encoding = encoding or ClipEncoding()
+        self.suffix = encoding.suffix
+        context = repr((vst_name, sorted(default_values.items()), di_digest, margin, sample_rate))
+        context += encoding.digest_key
+        self.context = hashlib.sha1(context.encode()).digest()
+        self.rendered: Dict[str, Path] = dict()
+
+    def keys(self, index: SettingsIndex) -> List[str]:
+        """
+        Returns the cache key of every file in a settings index, in order
+        """
+        # Hash the parameter vector in name order, so keys don't depend on column order
+        order = np.argsort(np.array(index.columns, dtype=str))
+        names = "\n".join(index.columns[i] for i in order).encode()
+        values = np.ascontiguousarray(index.values[:, order])
+        return [hashlib.sha1(self.context + names + row.tobytes()).hexdigest() for row in values]
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        Returns a clip rendered with the given key, if there is one
+        """
+        if key in self.rendered:
+            return self.rendered[key]
+        if self.cache_dir is not None and self.path(key).is_file():
+            return self.path(key)
+        return None
+
+    def store(self, key: str, clip: Path) -> None:
+        self.rendered[key] = clip
+        if self.cache_dir is not None and not self.path(key).is_file():
+            self.path(key).parent.mkdir(parents=True, exist_ok=True)
+            link_file(clip, self.path(key))
+
+    def missing(self, keys: List[str], file_indices: Sequence[int], output_dir: Path) -> List[int]:
+        """
+        Returns the file indices that need rendering: the first file with
+        each key that is not already cached.  Those files are reserved as
+        the clips for their keys straight away, so that later jobs can be
+        planned while this one is still being rendered.
+        """
+        first_seen = dict()
+        for file_idx in file_indices:
+            if self.lookup(keys[file_idx]) is None:
+                first_seen.setdefault(keys[file_idx], file_idx)
+        for key, file_idx in first_seen.items():
+            self.rendered[key] = clip_path(output_dir, file_idx, self.suffix)
+        return sorted(first_seen.values())
+
+    def fill(self, keys: List[str], file_indices: Sequence[int], rendered: Sequence[int], output_dir: Path) -> None:
+        """
+        Stores the newly rendered clips, then links every other file to its cached clip
+        """
+        for file_idx in rendered:
+            self.store(keys[file_idx], clip_path(output_dir, file_idx, self.suffix))
+        rendered = set(rendered)
+        for file_idx in file_indices:
+            if file_idx not in rendered:
+                link_file(self.lookup(keys[file_idx]), clip_path(output_dir, file_idx, self.suffix))
+
+
+def link_file(src: Path, dst: Path) -> None:
+    """
+    Hardlinks src to dst, replacing dst, and falls back to a copy when
+    the two are on different filesystems
+    """
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def looped_di_file(di_file: Path, times: int, margin: float, cache_dir: Path, di_digest: Optional[str]=None,
+                   max_bytes: Optional[int]=None) -> Path:
+    """
+    Returns the DI looped times times with margin seconds of silence before
+    each repetition, tiling it only if it is not already in cache_dir.
+    Entries are keyed by the DI's content hash, times, margin and sample
+    rate, so they are shared by every config and sweep (and by bounded
+    render jobs of the same size) that loop the same DI.  With max_bytes,
+    the least recently used looped DIs are evicted to keep the cache
+    within that size (see prune_cache).
+
+    Args:
+            di_file (Path): The original DI file
+            times (int): Number of times to repeat the DI
+            margin (float): Seconds of silence before each repetition
+            cache_dir (Path): The directory holding looped DIs
+            di_digest (str): The content hash of di_file, if already known
+            max_bytes (int): The size limit of cache_dir, or None for no limit
+
+    Returns:
+        Path: the looped DI
+    """
+    if di_digest is None:
+        di_digest = file_digest(di_file)
+    sample_rate = read_wav_info(di_file).sample_rate
+    looped_file = cache_dir / f"{di_digest[:16]}-{times}x-{margin:g}s-{sample_rate}.wav"
+    if not looped_file.is_file():
+        write_atomic(looped_file, lambda tmp_file: tile_wav(di_file, tmp_file, times, margin))
+    use_cached(looped_file, max_bytes)
+    return looped_file
+
+
+def combined_di_file(di_files: List[Path], margin: float, cache_dir: Path,
+                     di_digests: Optional[List[str]]=None, max_bytes: Optional[int]=None) -> Path:
+    """
+    Returns the DIs concatenated back to back, each preceded by margin
+    seconds of silence (see wav_helpers.concat_wavs), writing it only if it
+    is not already in cache_dir.  Keyed by the DIs' content hashes, in
+    order, the margin and the sample rate.  Evicts as looped_di_file does.
+    """
+    if di_digests is None:
+        di_digests = [file_digest(f) for f in di_files]
+    sample_rate = read_wav_info(di_files[0]).sample_rate
+    key = hashlib.sha1("\n".join(di_digests).encode()).hexdigest()[:16]
+    combined_file = cache_dir / f"{key}-{len(di_files)}di-{margin:g}s-{sample_rate}.wav"
+    if not combined_file.is_file():
+        write_atomic(combined_file, lambda tmp_file: concat_wavs(di_files, tmp_file, margin))
+    use_cached(combined_file, max_bytes)
+    return combined_file
+
+
+def use_cached(path: Path, max_bytes: Optional[int]=None) -> None:
+    """
+    Marks a cached file as just used, then prunes its directory to max_bytes
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # Evicted by another instance in the meantime; the caller still holds the name
+        pass
+    if max_bytes is not None:
+        prune_cache(path.parent, max_bytes, keep=path)
+
+
+def prune_cache(cache_dir: Path, max_bytes: int, keep: Path) -> None:
+    """
+    Deletes the least recently used .wav files in cache_dir (by modification
+    time, which use_cached updates) until they total at most max_bytes,
+    never deleting keep.  Files that another process deleted first, or that
+    cannot be deleted while in use, are skipped.
+    """
+    entries = []
+    for path in cache_dir.glob("*.wav"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue
+        total -= size
+
@@ -0,0 +1,238 @@
+"""
+Random access to a rendered output directory for training
+
+Example:
+    Reading batches of (DI, rendered audio, parameters) from an output
+    directory rendered with --index_format npz::
+
+        >>> from dataset import RenderedDataset
+        >>> data = RenderedDataset("/output/Brand/VST/Device/config/di")
+        >>> di, audio, params = data[0]
+        >>> dis, audios, params = data[0:64]
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from index_helpers import load_index
+from wav_helpers import (WavInfo, WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, read_wav_info,
+                         sample_format, make_fmt_chunk, decode_frames)
+from encoding_helpers import CLIP_FORMAT_FILE, resample
+from shard_helpers import SHARD_DIR, ShardIndex
+
+
+def sample_dtype(float_samples: bool, bits_per_sample: int) -> Optional[np.dtype]:
+    """
+    The NumPy dtype of little-endian samples, or None if there is none (24-bit PCM)
+    """
+    if float_samples:
+        return np.dtype(f'<f{bits_per_sample // 8}') if bits_per_sample in (32, 64) else None
+    return {8: np.dtype('u1'), 16: np.dtype('<i2'), 32: np.dtype('<i4')}.get(bits_per_sample)
+
+
+class RenderedDataset:
+    """
+    A rendered output directory as a random-access dataset.
+
+    Item i is the i-th setting of the settings index (settings.npz or
+    settings.parquet): the DI, the clip rendered from it, and the vector
+    of the setting's parameter values, in columns order.  Parameters are
+    normalized to [0, 1] over the range each one spans in the config (its
+    sweeps and default, as recorded in the index), or, for indexes without
+    ranges, over the values in the index.  Parameters that do not vary,
+    or are neither swept nor have a default, are 0.  Items can be sliced
+    or indexed with an array to get batches.
+
+    Clips are read through np.memmap, from the shards if the directory
+    was packed with --shard_size_mb, otherwise from each clip file.  Each
+    shard is mapped once, so items are views into the shard and batches
+    of consecutive clips are one (batch, frames, channels) view, without
+    opening or copying anything per item.  Unpacked clip files are opened
+    and mapped per item instead (there may be millions of them, too many
+    to keep open), so pack with --shard_size_mb for training.
+
+    Samples keep their stored format (e.g. int16 for pcm16 clips);
+    multiply by audio_scale and di_scale to get floats in [-1, 1) (8-bit
+    PCM is also offset by 128).  24-bit PCM has no NumPy dtype, so such
+    clips are decoded to float32 copies instead, as are FLAC clips (which
+    requires soundfile).
+
+    Each clip starts with the margin of silence rendered before the DI.
+    With trim_margin, clips are cut to their last len(di) frames, so they
+    line up with the DI.  The DI is mapped too, unless it has to be
+    resampled to the clips' sample rate, in which case it is resampled
+    once into memory.
+    """
+
+    def __init__(self, output_dir: Path, index_file: Optional[Path]=None, di_file: Optional[Path]=None,
+                 columns: Optional[Sequence[str]]=None, trim_margin: bool=True):
+        self.output_dir = Path(output_dir)
+        if index_file is None:
+            found = [self.output_dir / f"settings.{f}" for f in ('npz', 'parquet')
+                     if (self.output_dir / f"settings.{f}").is_file()]
+            if not found:
+                raise FileNotFoundError(f"No settings.npz or settings.parquet in {self.output_dir} "
+                                        f"(render with --index_format npz)")
+            index_file = found[0]
+        index = load_index(index_file)
+        self.meta = index.meta
+        self.filenames = index.filenames
+        self.file_indices = np.array([int(Path(f).stem) for f in index.filenames.tolist()], dtype=np.int64)
+
+        # Normalized parameter vectors, in the requested column order
+        self.columns = tuple(columns) if columns is not None else index.columns
+        positions = {c: i for i, c in enumerate(index.columns)}
+        ranges = index.ranges
+        if ranges is None:
+            with np.errstate(all='ignore'):
+                ranges = np.stack([np.nanmin(index.values, axis=0, initial=np.inf),
+                                   np.nanmax(index.values, axis=0, initial=-np.inf)], axis=1)
+        params = np.zeros((len(index), len(self.columns)), dtype=np.float32)
+        for j, c in enumerate(self.columns):
+            if c in positions:
+                lo, hi = ranges[positions[c]]
+                if hi > lo:
+                    params[:, j] = np.nan_to_num((index.values[:, positions[c]] - lo) / (hi - lo), nan=0.0)
+        self.params = params
+
+        # Where the clips are
+        self.shards = None
+        if (self.output_dir / SHARD_DIR).is_dir():
+            self.shards = ShardIndex.load(self.output_dir / SHARD_DIR)
+            self.entries = self.shards.locate(self.file_indices)
+        self.mapped: Dict[str, np.memmap] = dict()
+        self.format = self.clip_format()
+        self.flac = self.format['codec'] == 'flac'
+        if self.flac:
+            try:
+                import soundfile
+            except ImportError:
+                raise ImportError("Reading FLAC clips requires soundfile (pip install soundfile)")
+        self.dtype = None if self.flac else sample_dtype(self.format['sample_format'] == 'float',
+                                                         self.format['bits_per_sample'])
+        pcm = self.format['sample_format'] == 'pcm' and self.dtype is not None
+        self.audio_scale = 2.0 ** (1 - self.format['bits_per_sample']) if pcm else 1.0
+
+        self.di, self.di_scale = self.load_di(Path(di_file) if di_file is not None else self.output_dir / self.meta['di_file'])
+        self.trim = len(self.di) if trim_margin else None
+
+    def __len__(self) -> int:
+        return len(self.file_indices)
+
+    def __getitem__(self, key) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (di, audio, params) for an item, with di and audio as
+        (frames, channels) arrays, or batched along a first axis for a
+        slice or array of items
+        """
+        if isinstance(key, (int, np.integer)):
+            item = range(len(self))[key]
+            return self.di, self.clip(item), self.params[item]
+        if isinstance(key, slice):
+            items = np.arange(*key.indices(len(self)))
+        else:
+            items = np.asarray(key)
+            items = np.flatnonzero(items) if items.dtype == bool else items.astype(np.int64)
+            items = np.where(items < 0, items + len(self), items)
+        audio = self.batch(items)
+        # A slice of the parameters is a view too
+        params = self.params[key] if isinstance(key, slice) else self.params[items]
+        return np.broadcast_to(self.di, (len(items),) + self.di.shape), audio, params
+
+    def clip_format(self) -> Dict:
+        """
+        The clip format recorded at split time, or else that of the first clip file
+        """
+        format_file = self.output_dir / CLIP_FORMAT_FILE
+        if format_file.is_file():
+            with open(format_file) as infile:
+                return json.load(infile)
+        if self.shards is not None:
+            raise FileNotFoundError(f"Shards without {CLIP_FORMAT_FILE} in {self.output_dir}")
+        info = read_wav_info(self.output_dir / str(self.filenames[0]))
+        return {'codec': 'wav',
+                'suffix': '.wav',
+                'sample_format': 'float' if sample_format(info) == WAVE_FORMAT_IEEE_FLOAT else 'pcm',
+                'bits_per_sample': info.bits_per_sample,
+                'sample_rate': info.sample_rate,
+                'channels': info.channels}
+
+    def load_di(self, di_file: Path) -> Tuple[np.ndarray, float]:
+        """
+        Maps the DI as (frames, channels), resampling it if the clips were
+        """
+        info = read_wav_info(di_file)
+        dtype = sample_dtype(sample_format(info) == WAVE_FORMAT_IEEE_FLOAT, info.bits_per_sample)
+        if dtype is not None and info.sample_rate == self.format['sample_rate']:
+            di = np.memmap(di_file, dtype=dtype, mode='r', offset=info.data_offset,
+                           shape=(info.n_frames * info.channels,)).reshape(-1, info.channels)
+            float_di = sample_format(info) == WAVE_FORMAT_IEEE_FLOAT
+            return di, 1.0 if float_di else 2.0 ** (1 - info.bits_per_sample)
+        with open(di_file, "rb") as f:
+            f.seek(info.data_offset)
+            di = decode_frames(f.read(info.n_frames * info.block_align), info)
+        if info.sample_rate != self.format['sample_rate']:
+            di = resample(di, info.sample_rate, self.format['sample_rate'])
+        return di, 1.0
+
+    def shard(self, name: str) -> np.memmap:
+        if name not in self.mapped:
+            self.mapped[name] = np.memmap(self.output_dir / SHARD_DIR / name, dtype=np.uint8, mode='r')
+        return self.mapped[name]
+
+    def samples(self, raw: np.ndarray, frames: int=-1) -> np.ndarray:
+        """
+        Views raw little-endian sample bytes as (frames, channels), or decodes them
+        """
+        channels = self.format['channels']
+        if self.dtype is not None:
+            return raw.view(self.dtype).reshape(frames, channels)
+        info = WavInfo(make_fmt_chunk(WAVE_FORMAT_PCM, channels, self.format['sample_rate'], 24), 0, 0)
+        return decode_frames(raw.tobytes(), info).reshape(frames, channels)
+
+    def clip(self, item: int) -> np.ndarray:
+        """
+        The clip of an item, as (frames, channels)
+        """
+        if self.shards is not None:
+            entry = self.entries[item]
+            offset, length = self.shards.offset[entry], self.shards.length[entry]
+            audio = self.samples(self.shard(self.shards.shard[entry])[offset:offset + length])
+        else:
+            path = self.output_dir / str(self.filenames[item])
+            if self.flac:
+                import soundfile
+                audio, _ = soundfile.read(path, dtype='float32', always_2d=True)
+            else:
+                if path.suffix == '.wav':
+                    info = read_wav_info(path)
+                    offset, length = info.data_offset, info.n_frames * info.block_align
+                else:
+                    offset, length = 0, path.stat().st_size
+                audio = self.samples(np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(length,)))
+        return audio[-self.trim:] if self.trim and len(audio) >= self.trim else audio
+
+    def batch(self, items: np.ndarray) -> np.ndarray:
+        """
+        The clips of several items, as (batch, frames, channels).  Clips
+        packed back to back in one shard are a single view, others are stacked.
+        """
+        if len(items) == 0:
+            frames = self.trim or (len(self.clip(0)) if len(self) > 0 else 0)
+            dtype = self.dtype if self.dtype is not None else np.float32
+            return np.empty((0, frames, self.format['channels']), dtype=dtype)
+        if self.shards is not None and len(items) > 0:
+            entries = self.entries[items]
+            lengths = self.shards.length[entries]
+            offsets = self.shards.offset[entries]
+            names = self.shards.shard[entries]
+            length = lengths[0]
+            if (np.all(names == names[0]) and np.all(lengths == length)
+                    and np.all(offsets == offsets[0] + length * np.arange(len(items)))):
+                raw = self.shard(names[0])[offsets[0]:offsets[0] + length * len(items)]
+                audio = self.samples(raw).reshape(len(items), -1, self.format['channels'])
+                return audio[:, -self.trim:] if self.trim and audio.shape[1] >= self.trim else audio
+        return np.stack([self.clip(item) for item in items])
@@ -0,0 +1,170 @@
+import io
+import json
+from math import gcd
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from wav_helpers import (WavInfo, WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT,
+                         sample_format, make_fmt_chunk, decode_frames, encode_frames)
+from utils import write_atomic
+
+# File suffix of the clips written with each codec
+CODECS = {'wav': '.wav', 'flac': '.flac', 'raw': '.f32'}
+
+# Format tag and bits per sample of each output sample format
+SAMPLE_FORMATS = {'pcm16': (WAVE_FORMAT_PCM, 16),
+                  'pcm24': (WAVE_FORMAT_PCM, 24),
+                  'pcm32': (WAVE_FORMAT_PCM, 32),
+                  'float32': (WAVE_FORMAT_IEEE_FLOAT, 32)}
+
+# Sample formats FLAC can hold, as soundfile subtypes
+FLAC_SUBTYPES = {16: 'PCM_16', 24: 'PCM_24'}
+
+# Written next to the clips, so headerless (raw) clips can be read back
+CLIP_FORMAT_FILE = "clip_format.json"
+
+
+class ClipEncoding:
+    """
+    How split clips are written: as PCM/float WAV, FLAC or headerless
+    little-endian float32 (raw), optionally at another bit depth, resampled
+    to a target sample rate and downmixed to mono.
+
+    Unset options keep the format of the render.  When nothing changes,
+    clips are byte copies of the render; otherwise each clip is decoded,
+    downmixed, resampled (with a polyphase filter) and encoded in the
+    clip writer's threads.
+    """
+
+    def __init__(self, codec: str='wav', sample_format: Optional[str]=None,
+                 sample_rate: Optional[int]=None, mono: bool=False):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown clip codec: {codec}")
+        if sample_format is not None and sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unknown clip sample format: {sample_format}")
+        if codec == 'raw' and sample_format not in (None, 'float32'):
+            raise ValueError("Raw clips are always float32")
+        if codec == 'flac' and sample_format not in (None, 'pcm16', 'pcm24'):
+            raise ValueError("FLAC clips are pcm16 or pcm24")
+        self.codec = codec
+        self.sample_format = sample_format
+        self.sample_rate = sample_rate
+        self.mono = mono
+
+    @property
+    def suffix(self) -> str:
+        return CODECS[self.codec]
+
+    @property
+    def is_default(self) -> bool:
+        """
+        Whether clips are written in the render's own format, as before
+        """
+        return self.codec == 'wav' and self.sample_format is None and self.sample_rate is None and not self.mono
+
+    @property
+    def key(self) -> Tuple:
+        return (self.codec, self.sample_format, self.sample_rate, self.mono)
+
+    @property
+    def digest_key(self) -> str:
+        """
+        The part of run and render cache keys that depends on the encoding
+        """
+        # Clips in the default encoding keep the keys they had before encodings existed
+        return "" if self.is_default else repr(self.key)
+
+    def output_info(self, info: WavInfo) -> WavInfo:
+        """
+        The format of the clips cut from a render in the format of info
+        """
+        if self.codec == 'raw':
+            tag, bits = SAMPLE_FORMATS['float32']
+        elif self.sample_format is not None:
+            tag, bits = SAMPLE_FORMATS[self.sample_format]
+        elif self.codec == 'flac':
+            tag, bits = WAVE_FORMAT_PCM, 16 if info.bits_per_sample <= 16 else 24
+        else:
+            tag, bits = sample_format(info), info.bits_per_sample
+        channels = 1 if self.mono else info.channels
+        sample_rate = self.sample_rate or info.sample_rate
+        return WavInfo(make_fmt_chunk(tag, channels, sample_rate, bits), 0, 0)
+
+    def is_copy(self, info: WavInfo) -> bool:
+        """
+        Whether clips of a render in the format of info are plain byte copies
+        """
+        if self.codec != 'wav':
+            return False
+        out = self.output_info(info)
+        return (sample_format(out), out.bits_per_sample, out.channels, out.sample_rate) == \
+               (sample_format(info), info.bits_per_sample, info.channels, info.sample_rate)
+
+    def encode(self, data: bytes, info: WavInfo) -> Tuple[Optional[bytes], bytes]:
+        """
+        Encodes the raw sample data of one clip, in the format of info
+
+        Returns:
+            Tuple[Optional[bytes], bytes]: the format chunk and sample data of a
+                                           .wav clip, or None and the whole file
+        """
+        out = self.output_info(info)
+        frames = decode_frames(data, info)
+        if out.channels != info.channels:
+            frames = frames.mean(axis=1, keepdims=True)
+        if out.sample_rate != info.sample_rate:
+            frames = resample(frames, info.sample_rate, out.sample_rate)
+        if self.codec == 'raw':
+            return None, frames.astype('<f4').tobytes()
+        if self.codec == 'flac':
+            try:
+                import soundfile
+            except ImportError:
+                raise ImportError("FLAC clips require soundfile (pip install soundfile)")
+            buffer = io.BytesIO()
+            soundfile.write(buffer, frames, out.sample_rate, format='FLAC',
+                            subtype=FLAC_SUBTYPES[out.bits_per_sample])
+            return None, buffer.getvalue()
+        return out.fmt_chunk, encode_frames(frames, out)
+
+    def describe(self, info: WavInfo) -> Dict:
+        """
+        The format of the clips cut from a render in the format of info, as
+        recorded in clip_format.json
+        """
+        out = self.output_info(info)
+        return {'codec': self.codec,
+                'suffix': self.suffix,
+                'sample_format': 'float' if sample_format(out) == WAVE_FORMAT_IEEE_FLOAT else 'pcm',
+                'bits_per_sample': out.bits_per_sample,
+                'sample_rate': out.sample_rate,
+                'channels': out.channels}
+
+    def write_format(self, output_dir: Path, info: WavInfo) -> None:
+        """
+        Records the clip format in output_dir, replacing it atomically, as
+        several workers may split into the same directory
+        """
+        clip_format = json.dumps(self.describe(info), indent=2)
+        write_atomic(output_dir / CLIP_FORMAT_FILE, lambda tmp_file: tmp_file.write_text(clip_format))
+
+
+def resample(frames: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Resamples (frames, channels) audio with a polyphase FIR filter
+    """
+    try:
+        from scipy.signal import resample_poly
+    except ImportError:
+        raise ImportError("Resampling clips requires scipy (pip install scipy)")
+    g = gcd(sample_rate, target_rate)
+    return resample_poly(frames, target_rate // g, sample_rate // g, axis=0).astype(np.float32)
+
+
+def make_encoding(args) -> ClipEncoding:
+    """
+    The clip encoding chosen on the command line
+    """
+    return ClipEncoding(args.clip_codec, args.clip_sample_format, args.clip_sample_rate, args.mono)
@@ -1,34 +1,214 @@
-from typing import Dict, List
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Optional, Sequence
 from pathlib import Path
 
-# For segmenting processed wavs
-from pydub import AudioSegment
-from pydub.utils import make_chunks
+from wav_helpers import WavInfo, read_wav_info, write_wav_header
+from encoding_helpers import ClipEncoding
+from shard_helpers import ShardWriter
 
-def split_audio(wav_file, clip_len, output_dir, idx_offset=0, verbose: bool=False) -> None:
+
+class ClipWriter:
+    """
+    Writes clips on a pool of worker threads behind a bounded queue.
+
+    Submitting blocks once max_pending writes are in flight, so the reader
+    can only run a fixed number of clips ahead of the disk and memory use
+    stays bounded.  With a single worker, writes happen synchronously.
+    Errors raised by a write are re-raised on the next submit or on close.
+    """
+
+    def __init__(self, num_workers: int=1, max_pending: Optional[int]=None, fsync: bool=False):
+        self.num_workers = max(num_workers, 1)
+        self.fsync = fsync
+        self.pool = ThreadPoolExecutor(max_workers=self.num_workers) if self.num_workers > 1 else None
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * self.num_workers)
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.pool is not None:
+            # Don't mask the error that stopped the reader with a failed write
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def submit(self, fn: Callable, *args) -> None:
+        self.check()
+        if self.pool is None:
+            fn(*args)
+            return
+        self.slots.acquire()
+        future = self.pool.submit(fn, *args)
+        future.add_done_callback(self._release)
+
+    def write(self, path: Path, fmt_chunk: bytes, data: bytes) -> None:
+        self.submit(write_clip, path, fmt_chunk, data, self.fsync)
+
+    def encode(self, path: Path, info: WavInfo, data: bytes, encoding: ClipEncoding) -> None:
+        # Transcoding runs on the worker threads too
+        self.submit(encode_clip, path, info, data, encoding, self.fsync)
+
+    def check(self) -> None:
+        if self.errors:
+            raise self.errors[0]
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        self.check()
+
+    def _release(self, future: Future) -> None:
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+        self.slots.release()
+
+
+def write_clip(path: Path, fmt_chunk: Optional[bytes], data: bytes, fsync: bool=False) -> None:
+    """
+    Writes the raw sample data of one clip to a .wav file
+
+    Args:
+            path (Path): The output .wav file
+            fmt_chunk (bytes): The format chunk copied from the source file, or
+                               None if data is already a whole file (e.g. FLAC)
+            data (bytes): The sample data of the clip
+            fsync (bool): Whether to flush the file to disk before returning
+
+    Returns:
+        None
     """
-    Splits the rendered audio .wav file into many, one for each setting
+    # Replace rather than truncate, so a clip hardlinked into the render cache is never overwritten
+    if path.exists():
+        path.unlink()
+    with open(path, "wb") as dst:
+        if fmt_chunk is not None:
+            write_wav_header(dst, fmt_chunk, len(data))
+        dst.write(data)
+        if fmt_chunk is not None and len(data) % 2:
+            dst.write(b'\x00')
+        if fsync:
+            dst.flush()
+            os.fsync(dst.fileno())
+
+
+def encode_clip(path: Path, info: WavInfo, data: bytes, encoding: ClipEncoding, fsync: bool=False) -> None:
+    """
+    Encodes the raw sample data of one clip, in the format of info, and writes it
+    """
+    fmt_chunk, data = encoding.encode(data, info)
+    write_clip(path, fmt_chunk, data, fsync)
+
+
+def encode_samples(info: WavInfo, data: bytes, encoding: ClipEncoding) -> bytes:
+    """
+    Encodes the raw sample data of one clip, without any file header
+    """
+    return encoding.encode(data, info)[1]
+
+
+def clip_path(output_dir: Path, file_idx: int, suffix: str='.wav') -> Path:
+    """
+    The path of the clip of a file index
+    """
+    return output_dir / f"{file_idx:08d}{suffix}"
+
+
+def split_audio(wav_file, clip_len, output_dir, idx_offset=0, num_clips: Optional[int]=None,
+                num_workers: int=1, fsync: bool=False, indices: Optional[Sequence[int]]=None,
+                stride: Optional[float]=None, offset: float=0.0, positions: Optional[Sequence[int]]=None,
+                encoding: Optional[ClipEncoding]=None, shards: Optional[ShardWriter]=None,
+                verbose: bool=False) -> str:
+    """
+    Splits the rendered audio .wav file into many, one for each setting.
+
+    The render is never loaded into memory: each clip is read straight
+    from the source file at an exact sample offset, so the i-th clip
+    starts at round(i * clip_len * sample_rate) and boundaries do not
+    drift over long renders.  Clips are read sequentially and handed to
+    a ClipWriter, which writes them in parallel when num_workers > 1.
+    Clips are byte copies of the render, unless an encoding changes their
+    codec, sample format, sample rate or channels.  With a ShardWriter,
+    clips are packed into its shards instead of written as files.
 
     Args:
             wav_file (Path): The output .wav file generated by REAPER
             clip_len (float): The length in seconds of each clip
             output_dir (Path): The output directory to write split files
+            idx_offset (int): The index of the first clip's filename
+            num_clips (int): The number of clips to write.  If None, the whole
+                             file is split, including a shorter final clip.
+            num_workers (int): The number of threads writing clips
+            fsync (bool): Whether each clip is flushed to disk after writing
+            indices (Sequence[int]): Optionally, the filename index of each clip,
+                                     overriding idx_offset and num_clips
+            stride (float): The seconds between the starts of clips, if not clip_len
+            offset (float): The start in seconds of the first clip
+            positions (Sequence[int]): Optionally, the position of each clip in the
+                                       file, if not consecutive (clip at position p
+                                       starts at round((p * stride + offset) * sample_rate))
+            encoding (ClipEncoding): How clips are written (default is a copy as .wav)
+            shards (ShardWriter): Optionally, the shards to pack clips into
 
     Returns:
-        None
+        str: a SHA-1 checksum of the sample data of all clips, in order
     """
-    # Split into chunks
     if verbose:
         print(f"Splitting {wav_file}...")
-#        msg(f"Splitting {wav_file}...")
-    audio = AudioSegment.from_file(wav_file , "wav")
-    chunk_length_ms = clip_len * 1000 # pydub calculates in millisec
-    chunks = make_chunks(audio, chunk_length_ms)
+    info = read_wav_info(wav_file)
+    encoding = encoding or ClipEncoding()
+    copy = encoding.is_copy(info)
+    if shards is not None and encoding.codec == 'flac':
+        raise ValueError("FLAC clips cannot be packed into shards")
+    frames_per_clip = (clip_len if stride is None else stride) * info.sample_rate
+    clip_frames = round(clip_len * info.sample_rate)
+    offset_frames = offset * info.sample_rate
+    if indices is None:
+        if num_clips is None:
+            num_clips = int(-(-(info.n_frames - offset_frames) // frames_per_clip))
+        indices = range(idx_offset, idx_offset + num_clips)
+    if positions is None:
+        positions = range(len(indices))
     # If the output dir does not exist, make it
     output_dir.mkdir(parents=True, exist_ok=True)
+    if not encoding.is_default or shards is not None:
+        encoding.write_format(output_dir, info)
     # Write to file
-    for i, chunk in enumerate(chunks):
-        chunk.export(output_dir / f"{i+idx_offset:08d}.wav", format="wav")
+    checksum = hashlib.sha1()
+    with open(wav_file, "rb") as src, ClipWriter(num_workers if shards is None else 1, fsync=fsync) as writer:
+        for position, file_idx in zip(positions, indices):
+            start = round(position * frames_per_clip + offset_frames)
+            stop = min(start + clip_frames, info.n_frames)
+            src.seek(info.data_offset + start * info.block_align)
+            data = src.read(max(stop - start, 0) * info.block_align)
+            checksum.update(data)
+            if shards is not None:
+                if copy:
+                    shards.add(file_idx, data)
+                else:
+                    shards.submit(file_idx, encode_samples, info, data, encoding)
+            elif copy:
+                writer.write(clip_path(output_dir, file_idx), info.fmt_chunk, data)
+            else:
+                writer.encode(clip_path(output_dir, file_idx, encoding.suffix), info, data, encoding)
+    return checksum.hexdigest()
+
+
+def file_digest(file: Path) -> str:
+    """
+    Returns the SHA-1 digest of a file's contents, read in bounded blocks
+    """
+    digest = hashlib.sha1()
+    with open(file, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 def delete_tmp_files(files: List[Path], verbose: bool=False) -> None:
@@ -43,7 +223,7 @@ def delete_tmp_files(files: List[Path], verbose: bool=False) -> None:
     """
     for file in files:
         if file.is_file():
-            if args.verbose:
+            if verbose:
                 print(f"Deleting rendered file: {file}")
 #                msg(f"Deleting rendered file: {file}")
             file.unlink()
@@ -0,0 +1,138 @@
+import json
+from typing import Dict, Iterator, List, Optional, Sequence
+from pathlib import Path
+
+import numpy as np
+
+# Formats accepted for the settings index, by file suffix
+INDEX_FORMATS = ('yaml', 'npz', 'parquet')
+
+
+class SettingsIndex:
+    """
+    A columnar settings index for a rendered output directory.
+
+    Holds one entry per rendered file: its filename, the sweep it came from,
+    and the value of every parameter (the swept value if the parameter was
+    swept, otherwise its default), as a (n_files, n_columns) float array.
+    Global information (brand, device, DI file, ...) is kept in meta.
+
+    ranges holds the (min, max) each column can take in the config, over
+    all of its sweeps and its default, as a (n_columns, 2) float array, so
+    values can be normalized even when only a sample was rendered.  It is
+    None for indexes written before ranges were recorded.
+    """
+
+    def __init__(self, meta: Dict[str, str], filenames: np.ndarray, sweeps: np.ndarray,
+                 columns: Sequence[str], values: np.ndarray, ranges: Optional[np.ndarray]=None):
+        self.meta = meta
+        self.filenames = filenames
+        self.sweeps = sweeps
+        self.columns = tuple(columns)
+        self.values = values
+        self.ranges = ranges
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def rows(self) -> Iterator[Dict]:
+        """
+        Yields one dict per file, with the same keys as a settings.yaml entry
+        """
+        for filename, row in zip(self.filenames.tolist(), self.values.tolist()):
+            d = dict(self.meta)
+            d['filename'] = filename
+            # NaN marks a parameter that is neither swept nor has a default here
+            d.update((c, v) for c, v in zip(self.columns, row) if v == v)
+            yield d
+
+
+def write_index(out_file: Path, index: SettingsIndex) -> None:
+    """
+    Writes a settings index as .npz or .parquet, chosen by the file suffix
+
+    Args:
+            out_file (Path): The index file to write
+            index (SettingsIndex): The index
+
+    Returns:
+        None
+    """
+    out_file = Path(out_file)
+    if out_file.suffix == '.npz':
+        ranges = dict(ranges=index.ranges) if index.ranges is not None else dict()
+        np.savez(out_file,
+                 meta_keys=np.array(list(index.meta.keys()), dtype=str),
+                 meta_values=np.array([str(v) for v in index.meta.values()], dtype=str),
+                 filename=index.filenames,
+                 sweep=index.sweeps,
+                 columns=np.array(index.columns, dtype=str),
+                 values=index.values,
+                 **ranges)
+    elif out_file.suffix == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrays = [pa.array(index.filenames), pa.array(index.sweeps)]
+        arrays += [pa.array(index.values[:, c]) for c in range(len(index.columns))]
+        names = ['filename', 'sweep'] + list(index.columns)
+        metadata = {f"meta:{k}": str(v) for k, v in index.meta.items()}
+        if index.ranges is not None:
+            metadata['ranges'] = json.dumps(index.ranges.tolist())
+        pq.write_table(pa.Table.from_arrays(arrays, names=names, metadata=metadata), out_file)
+    else:
+        raise ValueError(f"Unsupported settings index format: {out_file.suffix}")
+
+
+def load_index(index_file: Path) -> SettingsIndex:
+    """
+    Loads a settings index written by write_index
+
+    Args:
+            index_file (Path): The .npz or .parquet index file
+
+    Returns:
+        SettingsIndex: the loaded index
+    """
+    index_file = Path(index_file)
+    if index_file.suffix == '.npz':
+        with np.load(index_file, allow_pickle=False) as data:
+            meta = dict(zip(data['meta_keys'].tolist(), data['meta_values'].tolist()))
+            return SettingsIndex(meta, data['filename'], data['sweep'],
+                                 data['columns'].tolist(), data['values'],
+                                 data['ranges'] if 'ranges' in data.files else None)
+    elif index_file.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(index_file)
+        metadata = table.schema.metadata or {}
+        meta = {k.decode()[5:]: v.decode() for k, v in metadata.items() if k.startswith(b'meta:')}
+        columns = table.column_names[2:]
+        values = np.stack([table.column(c).to_numpy() for c in columns], axis=1) if columns \
+            else np.empty((table.num_rows, 0))
+        return SettingsIndex(meta,
+                             np.array(table.column('filename').to_pylist(), dtype=str),
+                             np.array(table.column('sweep').to_pylist(), dtype=str),
+                             columns, values,
+                             np.array(json.loads(metadata[b'ranges'])).reshape(-1, 2) if b'ranges' in metadata else None)
+    raise ValueError(f"Unsupported settings index format: {index_file.suffix}")
+
+
+def find_indexes(base_dir: Path) -> List[Path]:
+    """
+    Finds the settings index of every output directory under base_dir,
+    preferring a binary index over settings.yaml when both exist
+
+    Args:
+            base_dir (Path): The root directory to search
+
+    Returns:
+        List[Path]: the index files to read
+    """
+    found = dict()
+    for p in sorted(Path(base_dir).rglob("*")):
+        if p.suffix in ('.yaml', '.npz', '.parquet'):
+            found.setdefault(p.parent, []).append(p)
+    indexes = []
+    for files in found.values():
+        binary = [p for p in files if p.suffix != '.yaml' and p.stem == 'settings']
+        indexes += binary[:1] if binary else [p for p in files if p.suffix == '.yaml']
+    return indexes
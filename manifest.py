@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional
+
+from file_helpers import clip_path
+from utils import write_atomic
+
+
+class RenderManifest:
+    """
+    A checkpoint manifest for a single render run.
+
+    Records each finished unit of work (a sweep, or a chunk of one) with
+    the range of file indices it produced, a checksum of its audio and the
+    total size of its clip files, so that an interrupted run can skip
+    completed units when restarted.  A unit whose clips are missing or no
+    longer add up to that size (e.g. truncated by a crash before they
+    reached the disk) is rendered again.  The
+    manifest belongs to one run key (a digest of the config, DI and
+    sampling options); if the key changes, the old progress is discarded.
+    """
+
+    def __init__(self, path: Path, run_key: str):
+        self.path = path
+        self.run_key = run_key
+        self.seed = None
+        self.units: Dict[str, Dict] = dict()
+        if path.is_file():
+            with open(path) as infile:
+                state = json.load(infile)
+            if state.get('run_key') == run_key:
+                self.seed = state.get('seed')
+                self.units = state.get('units', dict())
+
+    def is_done(self, unit: str, start: int, stop: int, output_dir: Path, suffix: str='.wav', shards=None) -> bool:
+        """
+        Whether the unit finished with the same file range and its files
+        still exist with the recorded size (or are packed in the given
+        ShardIndex, whose shards are only indexed once complete)
+        """
+        entry = self.units.get(unit)
+        if entry is None or (entry['start'], entry['stop']) != (start, stop):
+            return False
+        if shards is not None:
+            return shards.covers(start, stop)
+        size = unit_bytes(output_dir, start, stop, suffix)
+        # Manifests written before sizes were recorded only check that the files exist
+        return size is not None and entry.get('bytes', size) == size
+
+    def complete(self, unit: str, start: int, stop: int, checksum: Optional[str],
+                 output_dir: Optional[Path]=None, suffix: str='.wav') -> None:
+        """
+        Records a finished unit, with the total size of its clip files in
+        output_dir (None when the clips are packed into shards)
+        """
+        entry = {'start': start, 'stop': stop, 'checksum': checksum}
+        if output_dir is not None:
+            entry['bytes'] = unit_bytes(output_dir, start, stop, suffix)
+        self.units[unit] = entry
+        self.save()
+
+    def save(self) -> None:
+        # A crash never leaves a half-written manifest
+        state = {'run_key': self.run_key, 'seed': self.seed, 'units': self.units}
+        write_atomic(self.path, lambda tmp_file: tmp_file.write_text(json.dumps(state, indent=2)))
+
+
+def unit_bytes(output_dir: Path, start: int, stop: int, suffix: str='.wav') -> Optional[int]:
+    """
+    The total size of the clip files of a range of file indices, or None if any is missing
+    """
+    total = 0
+    for i in range(start, stop):
+        try:
+            total += clip_path(output_dir, i, suffix).stat().st_size
+        except FileNotFoundError:
+            return None
+    return total
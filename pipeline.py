@@ -0,0 +1,69 @@
+import queue
+import threading
+from typing import Callable
+
+
+class BackgroundWorker:
+    """
+    Runs tasks in order on a background thread behind a bounded queue.
+
+    Used to overlap postprocessing (splitting, indexing) of one render job
+    with the rendering of the next.  Submitting blocks once max_pending
+    tasks are waiting, so rendering can only run a fixed number of jobs
+    ahead.  If a task fails, the remaining tasks are skipped and the error
+    is re-raised in the submitting thread on the next submit or on close.
+    With max_pending=0, tasks run synchronously in the calling thread.
+    """
+
+    def __init__(self, max_pending: int=1):
+        self.error = None
+        self.thread = None
+        if max_pending > 0:
+            self.tasks = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the error that stopped the producer
+            self.error = self.error or exc_value
+            self._stop()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        self.check()
+        if self.thread is None:
+            fn(*args, **kwargs)
+        else:
+            self.tasks.put((fn, args, kwargs))
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def close(self) -> None:
+        self._stop()
+        self.check()
+
+    def _stop(self) -> None:
+        if self.thread is not None:
+            self.tasks.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            if self.error is not None:
+                continue
+            fn, args, kwargs = task
+            try:
+                fn(*args, **kwargs)
+            except BaseException as e:
+                self.error = e
@@ -1,4 +1,8 @@
-from typing import Dict, List
+import re
+import json
+import time
+import hashlib
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 import reapy
@@ -6,8 +10,76 @@ import reapy.reascript_api as RPR
 from reapy.core.track import Track
 from reapy.core.project import Project
 
+from utils import write_atomic
 
-def get_fx_envelopes(track: Track, param_names: List[str], fx_number: int=0, threshold: int=-1) -> Dict[str,str]:
+
+class ParamSchemaCache:
+    """
+    A plugin's parameter schema (name -> index, and each parameter's range),
+    persisted on disk so that envelope setup does not rescan every
+    parameter of the plugin on each sweep and run.
+
+    The schema is filled lazily: a lookup scans parameters in order only
+    until all requested names are resolved, and records how far it got,
+    so later lookups continue from there.  The cache file is keyed by the
+    plugin's name, its REAPER identifier and its parameter count.
+    """
+
+    def __init__(self, track: Track, fx_number: int=0, cache_dir: Optional[Path]=None):
+        self.track = track
+        self.fx_number = fx_number
+        fx_name = RPR.TrackFX_GetFXName(track.id, fx_number, "", 2048)[3]
+        fx_ident = RPR.TrackFX_GetNamedConfigParm(track.id, fx_number, "fx_ident", "", 2048)[4]
+        self.n_params = RPR.TrackFX_GetNumParams(track.id, fx_number)
+        key = hashlib.sha1(repr((fx_name, fx_ident, self.n_params)).encode()).hexdigest()[:16]
+        self.path = None
+        if cache_dir is not None:
+            safe_name = re.sub(r'[^\w.-]+', '_', fx_name).strip('_')
+            self.path = cache_dir / f"{safe_name}-{key}.json"
+        self.scanned = 0
+        self.params: Dict[str, Tuple[int, float, float]] = dict()
+        if self.path is not None and self.path.is_file():
+            with open(self.path) as infile:
+                schema = json.load(infile)
+            self.scanned = schema['scanned']
+            self.params = {name: tuple(p) for name, p in schema['params'].items()}
+
+    def resolve(self, param_names: List[str], threshold: int=-1) -> Dict[str, int]:
+        """
+        Returns the parameter index of each name in param_names that the plugin has
+
+        Args:
+            param_names (List[str]): The names of the FXParams to look up
+            threshold (int): Only consider the first threshold parameters (if > 0)
+
+        Returns:
+            dict[str,int]: a mapping of param names to their indices
+        """
+        limit = min(self.n_params, threshold) if threshold > 0 else self.n_params
+        wanted = set(param_names)
+        if not wanted.issubset(self.params) and self.scanned < limit:
+            with reapy.inside_reaper():
+                while self.scanned < limit and not wanted.issubset(self.params):
+                    i = self.scanned
+                    name = RPR.TrackFX_GetParamName(self.track.id, self.fx_number, i, "", 2048)[4]
+                    min_val, max_val = RPR.TrackFX_GetParam(self.track.id, self.fx_number, i, 0, 0)[-2:]
+                    # As when enumerating every parameter, the last of several with one name wins
+                    self.params[name] = (i, min_val, max_val)
+                    self.scanned += 1
+            self.save()
+        return {name: self.params[name][0] for name in param_names
+                if name in self.params and self.params[name][0] < limit}
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        # Pool workers share the cache directory, so never leave a partial file in place
+        schema = json.dumps({'scanned': self.scanned, 'params': self.params})
+        write_atomic(self.path, lambda tmp_file: tmp_file.write_text(schema))
+
+
+def get_fx_envelopes(track: Track, param_names: List[str], fx_number: int=0, threshold: int=-1,
+                     schema_cache_dir: Optional[Path]=None) -> Dict[str,str]:
     """
     Returns the FX envelopes for the param_names provided.
     Args:
@@ -15,25 +87,63 @@ def get_fx_envelopes(track: Track, param_names: List[str], fx_number: int=0, thr
         param_names (List[str]): The names of the FXParams to change
         fx_number (int): The idx of the fx (should be 0 unless multiple FX)
         threshold (int): Maximum number of envelopes to collect
+        schema_cache_dir (Path): Directory of the on-disk parameter schema cache
 
     Returns:
         dict[str,str]: a mapping of envelope names to their corresponding envelope ID str
     """
-    name2env = dict()
+    schema = ParamSchemaCache(track, fx_number, schema_cache_dir)
+    # Any parameter that receives a GetFXEnvelope call
+    # will have an envelope created in the track, so best
+    # to restrict it to the relevant set
+    return {name: RPR.GetFXEnvelope(track.id, fx_number, i, True)
+            for name, i in schema.resolve(param_names, threshold).items()}
 
-    for i, p in enumerate(track.fxs[0].params):
-        print(p.name)
-        if threshold > 0 and i >= threshold:
-            print("breaking on threshold")
-            break
-        else:
-            # Any parameter that receives a GetFXEnvelope call
-            # will have an envelope created in the track, so best
-            # to restrict it to the relevant set
-            if p.name in param_names:
-                name2env[p.name] = RPR.GetFXEnvelope(track.id, fx_number, i, True)
-    return name2env
 
+# Buffer sizes for reading an envelope state chunk: its header lines, and
+# an upper bound on each "PT time value shape ..." point line
+ENVELOPE_HEADER_BYTES = 1 << 16
+ENVELOPE_POINT_BYTES = 128
+
+
+def set_envelope_points(envelope: str, times: List[float], values: List[float], shape: int=1) -> None:
+    """
+    Replaces all points of an envelope in a single operation, by rewriting
+    the envelope's state chunk rather than inserting points one at a time.
+    Falls back to unsorted point insertion followed by a single sort if
+    the state chunk cannot be read.
+
+    Args:
+        envelope (str): The envelope ID str, as returned by get_fx_envelopes
+        times (List[float]): The time of each point in seconds, ascending
+        values (List[float]): The value of each point
+        shape (int): The point shape (1 is square, i.e. a step change)
+
+    Returns:
+        None
+    """
+    # Size the buffer for the points already on the envelope, which the chunk lists
+    buffer_size = ENVELOPE_HEADER_BYTES + ENVELOPE_POINT_BYTES * RPR.CountEnvelopePoints(envelope)
+    ok, _, chunk, _, _ = RPR.GetEnvelopeStateChunk(envelope, "", buffer_size, False)
+    if ok and chunk.rstrip().endswith(">"):
+        RPR.SetEnvelopeStateChunk(envelope, envelope_state_chunk(chunk, times, values, shape), False)
+    else:
+        with reapy.inside_reaper():
+            # Replace, rather than add to, the points of earlier sweeps
+            RPR.DeleteEnvelopePointRange(envelope, -1.0, 1e12)
+            for t, v in zip(times, values):
+                RPR.InsertEnvelopePoint(envelope, t, v, shape, 0, False, True)
+            RPR.Envelope_SortPoints(envelope)
+
+
+def envelope_state_chunk(chunk: str, times: List[float], values: List[float], shape: int=1) -> str:
+    """
+    Rewrites an envelope state chunk to hold exactly the given points
+    """
+    # Keep the envelope header, drop any existing points
+    header = [line for line in chunk.rstrip().splitlines()[:-1] if not line.startswith("PT ")]
+    points = [f"PT {t:.10f} {v:.10f} {shape}" for t, v in zip(times, values)]
+    return "\n".join(header + points + [">"]) + "\n"
 
 
 def copy_DI_reapy(project, di_file, times, margin) -> None:
@@ -63,6 +173,80 @@ def copy_DI_reapy(project, di_file, times, margin) -> None:
             RPR.InsertMedia(filename, 0)
 
 
+def loop_DI_item(project, padded_file, times) -> None:
+    """
+    Places the DI as a single media item whose source loops to cover the
+    desired samples, so placement takes a constant number of API calls
+    and leaves one item in the project, however many settings there are.
+
+    Args:
+            project (reapy.core.project.Project): The REAPER project
+            padded_file (Path): The DI, preceded by the margin of silence
+            times (int): Number of times to repeat the DI
+
+    Returns:
+        None
+    """
+    project.cursor_position = 0
+    with reapy.inside_reaper():
+        RPR.InsertMedia(str(padded_file.resolve()), 0)
+        # InsertMedia leaves the cursor at the end of the new item
+        period = project.cursor_position
+        item = project.tracks[0].items[-1]
+        RPR.SetMediaItemInfo_Value(item.id, "B_LOOPSRC", 1)
+        RPR.SetMediaItemInfo_Value(item.id, "D_LENGTH", period * times)
+        project.cursor_position = 0
+    RPR.UpdateArrangeView()
+
+
+def connect_instance(port: int, render_dir: Path) -> None:
+    """
+    Points reapy at the local REAPER instance whose web interface listens
+    on port, and makes that instance render into render_dir.  Each
+    instance must have been configured for reapy with its own port.
+
+    Args:
+            port (int): The web interface port of the REAPER instance
+            render_dir (Path): The directory the instance renders files to
+
+    Returns:
+        None
+    """
+    from reapy.tools.network import machines
+    reapy.config.WEB_INTERFACE_PORT = port
+    machines.CLIENTS.pop("localhost", None)
+    reapy.connect("localhost")
+    reapy.Project().set_info_string("RENDER_FILE", str(render_dir.resolve()))
+
+
+def wait_for_stable_output(track: Track, max_seconds: float, interval: float=0.25,
+                           tolerance: float=0.01, stable_windows: int=4) -> float:
+    """
+    Waits while the project plays until the track's output level settles,
+    i.e. its peak changes by less than tolerance over stable_windows
+    consecutive intervals, or until max_seconds have passed.  Used instead
+    of a fixed warmup sleep for plugins that settle quickly.
+
+    Args:
+            track (reapy.core.track.Track): The track the FX is on
+            max_seconds (float): The longest time to wait
+            interval (float): Seconds between peak readings
+            tolerance (float): Largest peak change counted as stable
+            stable_windows (int): Number of stable readings in a row required
+
+    Returns:
+        float: the seconds waited
+    """
+    start = time.perf_counter()
+    last_peak, stable = None, 0
+    while time.perf_counter() - start < max_seconds and stable < stable_windows:
+        time.sleep(interval)
+        peak = max(RPR.Track_GetPeakInfo(track.id, 0), RPR.Track_GetPeakInfo(track.id, 1))
+        stable = stable + 1 if last_peak is not None and abs(peak - last_peak) < tolerance else 0
+        last_peak = peak
+    return time.perf_counter() - start
+
+
 def get_clip_len(file: Path, project: Project):
     project.cursor_position = 0
     # Load DI on to track
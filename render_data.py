@@ -14,32 +14,42 @@ Example:
                                 --conf_file "config/NDSP Nameless Amp/nameless.yaml"
                                 --output_dir "/output"
                                 --reaper_dir "/Documents/REAPER Media/"
-                                --copy_method sox
+                                --copy_method tile
 """
 
 import sys
 import argparse
 from pathlib import Path
 import shutil
-
-# For generating extended DI outside of Python
-import subprocess
+import hashlib
+import threading
+from contextlib import nullcontext
 
 from typing import Dict, List
 
+import numpy as np
 
-
-import reapy
 import reapy.reascript_api as RPR
 #from reapy.core.project import Project
 #from reapy.core.track import Track
 
-from sweeps import Sweeper, SweepConfig
+from sweeps import Sweeper, SweepConfig, SAMPLING_METHODS
+from index_helpers import INDEX_FORMATS
 from utils import seconds_to_str, byte_to_str
 
-from reaper_helpers import get_fx_envelopes, copy_DI_reapy, get_clip_len, warmup
-from sox_helpers import copy_DI_sox
-from file_helpers import delete_tmp_files, split_audio
+from backends import BACKENDS, make_backend, di_cache
+from file_helpers import delete_tmp_files, split_audio, file_digest, clip_path
+from encoding_helpers import CODECS, SAMPLE_FORMATS, make_encoding
+from shard_helpers import SHARD_DIR, ShardWriter, ShardIndex
+from manifest import RenderManifest
+from pipeline import BackgroundWorker
+from cache_helpers import RenderCache, combined_di_file
+from worker_pool import InstancePool, current_instance
+from wav_helpers import read_wav_info, segment_starts
+from telemetry import Telemetry, RenderETA
+
+# Destination of logging messages, set from --logging
+MSG_MODE = 'stdout'
 
 
 def msg(message: str) -> None:
@@ -53,177 +63,565 @@ def msg(message: str) -> None:
     """
     if MSG_MODE in ('stdout', 'both'):
         print(message)
-    if MSG_MODE in ('console', 'both'):
+    # Only the main thread talks to REAPER; background workers log to stdout
+    if MSG_MODE in ('console', 'both') and threading.current_thread() is threading.main_thread():
         RPR.ShowConsoleMsg(message + "\n")
 
 
-def generate_data(args):
+def run_key(args) -> str:
+    """
+    A digest of everything that determines the files of a run, used to
+    decide whether a checkpoint manifest can be resumed
+    """
+    key = hashlib.sha1()
+    key.update(file_digest(args.conf_file).encode())
+    key.update(file_digest(args.di_file).encode())
+    key.update(repr((args.max_samples, args.seed, args.sampling, args.margin)).encode())
+    key.update(make_encoding(args).digest_key.encode())
+    return key.hexdigest()
+
+
+def settings_per_render(clip_len, args) -> int:
+    """
+    The maximum number of settings in one render job, from --max_settings_per_render
+    and --max_render_seconds, or -1 if renders are not bounded
+    """
+    limits = []
+    if args.max_settings_per_render > 0:
+        limits.append(args.max_settings_per_render)
+    if args.max_render_seconds > 0:
+        limits.append(max(int(args.max_render_seconds // (clip_len + args.margin)), 1))
+    return min(limits) if limits else -1
+
+
+def render_jobs(sweeper, clip_len, args):
+    """
+    Splits each sweep into render jobs of bounded size, numbering their
+    files consecutively across all sweeps in settings index order
+
+    Args:
+            sweeper (Sweeper): The sweeps to render
+            clip_len (float): The length in seconds of each clip
+            args (argparse): The configuration options
+
+    Returns:
+        Iterator of (unit name, sweep name, Sweep, range of file indices) per job
+    """
+    max_settings = settings_per_render(clip_len, args)
+    file_offset = 0
+    for sweep_idx, (sweep_name, sweep) in enumerate(sweeper.sweeps):
+        job_size = max_settings if 0 < max_settings < len(sweep) else max(len(sweep), 1)
+        for job_idx, start in enumerate(range(0, len(sweep), job_size)):
+            job = sweep[start:start + job_size]
+            unit = f"{sweep_idx}: {sweep_name}" if job_size >= len(sweep) else f"{sweep_idx}.{job_idx}: {sweep_name}"
+            yield unit, sweep_name, job, range(file_offset + start, file_offset + start + len(job))
+        file_offset += len(sweep)
+
+
+class RenderJob:
+    """
+    One bounded render: a (view onto a) sweep, the file indices it fills,
+    and which of those files actually need rendering
+    """
+
+    def __init__(self, unit, sweep_name, sweep, file_indices, render_indices):
+        self.unit = unit
+        self.sweep_name = sweep_name
+        self.sweep = sweep
+        self.file_indices = file_indices
+        self.render_indices = render_indices
+
+
+class RenderRun:
+    """
+    The render of one (DI, config) pair into its output directory.
+
+    Plans the render jobs (skipping those already in the checkpoint
+    manifest and settings already in the render cache), and completes
+    them in order once rendered, however the rendering is scheduled.
+    """
+
+    def __init__(self, args, config, clip_len, telemetry):
+        self.args = args
+        self.config = config
+        self.clip_len = clip_len
+        self.telemetry = telemetry
+        self.encoding = make_encoding(args)
+
+        # Resume from the checkpoint manifest of a previous, interrupted run
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = RenderManifest(args.output_dir / "manifest.json", run_key(args))
+        self.shards = ShardIndex.scan(args.output_dir / SHARD_DIR) if args.shard_size_mb > 0 else None
+
+        # Compute sweeps, reusing the sampling seed of the run being resumed
+        seed = args.seed if args.seed is not None else self.manifest.seed
+        self.sweeper = Sweeper(config, max_samples=args.max_samples, seed=seed, sampling=args.sampling)
+        self.manifest.seed = self.sweeper.seed
+        self.manifest.save()
+
+        # Key every setting by its full render context, to reuse clips already rendered
+        self.cache, self.cache_keys = None, None
+        if args.cache_dir is not None:
+            self.cache = RenderCache(args.cache_dir, config.vst_name, config.default_values(),
+                                     file_digest(args.di_file), args.margin, read_wav_info(args.di_file).sample_rate,
+                                     self.encoding)
+            self.cache_keys = self.cache.keys(self.sweeper.index(args.di_file))
+
+    def jobs(self):
+        """
+        Yields the render jobs that still need to be done, in order
+        """
+        for unit, sweep_name, sweep, file_indices in render_jobs(self.sweeper, self.clip_len, self.args):
+            job = self.plan(unit, sweep_name, sweep, file_indices)
+            if job is not None:
+                yield job
+
+    def plan(self, unit, sweep_name, sweep, file_indices):
+        """
+        Returns the render job for a unit, or None if it is already done
+        """
+        args = self.args
+        if self.manifest.is_done(unit, file_indices.start, file_indices.stop, args.output_dir, self.encoding.suffix,
+                                 self.shards):
+            if args.verbose:
+                msg(f"Skipping completed {unit}")
+            return None
+
+        # Only render settings not already in the cache (or repeated earlier in this run)
+        render_indices = list(file_indices)
+        if self.cache is not None:
+            render_indices = self.cache.missing(self.cache_keys, file_indices, args.output_dir)
+            if args.verbose:
+                msg(f"Reusing {len(sweep) - len(render_indices)} cached settings in {unit}")
+        if 0 < len(render_indices) < len(sweep):
+            sweep = sweep.take([file_idx - file_indices.start for file_idx in render_indices])
+        return RenderJob(unit, sweep_name, sweep, file_indices, render_indices)
+
+    def finish(self, job, rendered_file) -> None:
+        """
+        Splits the rendered file of a job (if any), then completes the job
+        """
+        checksum = None
+        if rendered_file is not None:
+            checksum = split_job(job, self.clip_len, rendered_file, self.args, self.telemetry)
+        self.complete(job, checksum)
+
+    def complete(self, job, checksum) -> None:
+        """
+        Links every cached or repeated setting of a split job to its clip,
+        and checkpoints the job in the manifest.  Jobs must complete in order.
+        """
+        if self.cache is not None:
+            rendered = set(job.render_indices)
+            linked = [i for i in job.file_indices if i not in rendered]
+            with self.telemetry.stage('link', job.unit, job.sweep_name, settings=len(linked),
+                                      audio_seconds=len(linked) * (self.clip_len + self.args.margin)):
+                self.cache.fill(self.cache_keys, job.file_indices, job.render_indices, self.args.output_dir)
+        self.manifest.complete(job.unit, job.file_indices.start, job.file_indices.stop, checksum,
+                               self.args.output_dir if self.shards is None else None, self.encoding.suffix)
+
+    def audio_seconds(self, jobs) -> float:
+        """
+        The seconds of audio the given jobs of this run render
+        """
+        return sum(len(job.render_indices) for job in jobs) * (self.clip_len + self.args.margin)
+
+    def close(self) -> None:
+        # write out settings in index file(s)
+        with self.telemetry.stage('index', settings=sum(len(sweep) for _, sweep in self.sweeper.sweeps)) as event:
+            for index_format in self.args.index_format.split(','):
+                index_file = self.args.output_dir / f"settings.{index_format}"
+                self.sweeper.write(index_file, self.args.di_file, self.encoding.suffix)
+                event['bytes_written'] += index_file.stat().st_size
+            # consolidate the offset indices of the shards
+            if self.shards is not None:
+                shard_dir = self.args.output_dir / SHARD_DIR
+                ShardIndex.scan(shard_dir).write(shard_dir)
+
+        # possibly copy the DI to the output directory
+        if self.args.copy_di:
+            shutil.copy(self.args.di_file, self.args.output_dir / self.args.di_file.name)
+
+
+class MultiDIRun:
+    """
+    The render of several DIs against one config in a single timeline.
+
+    Each setting gets one slot holding every DI back to back, each preceded
+    by the margin, so the FX is set up, warmed up and rendered once for all
+    the DIs.  Every DI keeps its own RenderRun (output directory, manifest,
+    render cache and settings index), all sharing one sampling seed, and
+    splitting routes each DI's segment of every slot to its own run.
+    """
+
+    def __init__(self, arg_sets, config, telemetry):
+        self.config = config
+        self.telemetry = telemetry
+        di_files = [args.di_file for args in arg_sets]
+        infos = [read_wav_info(di_file) for di_file in di_files]
+        self.runs = []
+        for args, info in zip(arg_sets, infos):
+            if self.runs and args.seed is None:
+                args = argparse.Namespace(**{**vars(args), 'seed': self.runs[0].sweeper.seed})
+            self.runs.append(RenderRun(args, config, info.duration, telemetry))
+
+        # Render the concatenated DIs as if they were one DI without a margin
+        margin = arg_sets[0].margin
+        # Apart from the looped DIs, which are evicted while the combined DI is still in use
+        di_cache_dir, di_cache_bytes = di_cache(arg_sets[0])
+        combined_file = combined_di_file(di_files, margin, di_cache_dir / "combined", max_bytes=di_cache_bytes)
+        starts = segment_starts(infos, margin)
+        sample_rate = infos[0].sample_rate
+        self.offsets = [start / sample_rate for start in starts[:-1]]
+        self.segment_lens = [(stop - start) / sample_rate for start, stop in zip(starts, starts[1:])]
+        self.clip_len = starts[-1] / sample_rate
+        self.args = argparse.Namespace(**{**vars(arg_sets[0]), 'di_file': combined_file, 'margin': 0.0})
+
+    def jobs(self):
+        """
+        Yields a job per unit that is not done for every DI, rendering the
+        settings that any DI still needs
+        """
+        for unit, sweep_name, sweep, file_indices in render_jobs(self.runs[0].sweeper, self.clip_len, self.args):
+            run_jobs = [run.plan(unit, sweep_name, sweep, file_indices) for run in self.runs]
+            if all(job is None for job in run_jobs):
+                continue
+            render_indices = sorted(set().union(*(job.render_indices for job in run_jobs if job is not None)))
+            if 0 < len(render_indices) < len(sweep):
+                sweep = sweep.take([file_idx - file_indices.start for file_idx in render_indices])
+            job = RenderJob(unit, sweep_name, sweep, file_indices, render_indices)
+            job.run_jobs = run_jobs
+            yield job
+
+    def audio_seconds(self, jobs) -> float:
+        return sum(len(job.render_indices) for job in jobs) * self.clip_len
+
+    def finish(self, job, rendered_file) -> None:
+        """
+        Splits each DI's segments of the rendered slots into its run, then
+        completes the job for every DI it was planned for
+        """
+        positions = {file_idx: position for position, file_idx in enumerate(job.render_indices)}
+        for run, run_job, offset, segment_len in zip(self.runs, job.run_jobs, self.offsets, self.segment_lens):
+            if run_job is None:
+                continue
+            checksum = None
+            if rendered_file is not None and run_job.render_indices:
+                args = run.args
+                with self.telemetry.stage('split', run_job.unit, run_job.sweep_name,
+                                          settings=len(run_job.render_indices),
+                                          audio_seconds=len(run_job.render_indices) * segment_len) as event:
+                    with make_shard_writer(args) or nullcontext() as shards:
+                        checksum = split_audio(rendered_file, segment_len, args.output_dir,
+                                               indices=run_job.render_indices,
+                                               positions=[positions[i] for i in run_job.render_indices],
+                                               stride=self.clip_len,
+                                               offset=offset,
+                                               num_workers=args.split_workers,
+                                               fsync=args.fsync,
+                                               encoding=run.encoding,
+                                               shards=shards,
+                                               verbose=args.verbose)
+                    event['bytes_written'] = clips_size(args, run_job.render_indices, shards)
+            run.complete(run_job, checksum)
+        if rendered_file is not None and delete_tmp(self.clip_len, self.args):
+            delete_tmp_files([rendered_file], verbose=self.args.verbose)
+
+    def close(self) -> None:
+        for run in self.runs:
+            run.close()
+
+
+def generate_data(args, telemetry=None):
     """
     The main data generation function
 
     Args:
             args (argparse): The configuration options specifying how to generate data
+            telemetry (Telemetry): Receives the timing events of each stage
 
     Returns:
         None
     """
+    telemetry = telemetry or Telemetry()
+
     # Read yaml settings for VST sweep
-    print(args.conf_file)
-    print()
+    if args.verbose:
+        msg(f"{args.conf_file}\n")
     config = SweepConfig(args.conf_file)
 
-    # Start Reaper project
-    project = reapy.Project()
+    # Start Reaper project (or its offline stand-in)
+    backend = make_backend(args)
 
-    clip_len = get_clip_len(args.di_file, project)
-    print(clip_len)
+    clip_len = backend.measure(args.di_file)
+    if args.verbose:
+        msg(f"Clip length: {clip_len}s")
 
-    # Compute sweeps
-    sweeper = Sweeper(config, max_samples=args.max_samples)
-    file_offset = 0
-    for sweep_name, sweep in sweeper.sweeps:
-        sweep = list(sweep)
+    render_run(RenderRun(args, config, clip_len, telemetry), backend, telemetry)
 
-        # Print stats on sweep beforehand
-        if args.verbose:
-            time_in_seconds = len(sweep) * clip_len
-            size_in_mb = byte_to_str(time_in_seconds * args.mb_per_second)
-            msg(f"Performing sweep {sweep_name}")
-            msg(f"Beginning sweep of {len(sweep)} settings, recording {clip_len}s of each.")
-            msg(f"This will create roughly {seconds_to_str(time_in_seconds)} ({size_in_mb}) of audio.")
-        render_data(sweep, clip_len, project, config.vst_name, config.default_values(), args)
-        split_data(args, clip_len, len(sweep), file_offset)
-        file_offset += len(sweep)
 
-    # write out settings in index file
-    sweeper.write(args.output_dir / "settings.yaml", args.di_file)
+def generate_data_multi(arg_sets, telemetry=None):
+    """
+    Renders several DIs against one config in a single timeline pass
+
+    Args:
+            arg_sets (List[argparse]): The configuration options of each DI, sharing one config
+            telemetry (Telemetry): Receives the timing events of each stage
+
+    Returns:
+        None
+    """
+    telemetry = telemetry or Telemetry()
+    config = SweepConfig(arg_sets[0].conf_file)
+    run = MultiDIRun(arg_sets, config, telemetry)
+    if arg_sets[0].verbose:
+        msg(f"Rendering {len(arg_sets)} DIs in {run.clip_len}s slots")
+    render_run(run, make_backend(run.args), telemetry)
+
 
-    # possibly copy the DI to the output directory
-    if args.copy_di:
-        shutil.copy(args.di_file, args.output_dir / args.di_file.name)
+def render_run(run, backend, telemetry) -> None:
+    """
+    Renders the jobs of a run one after the other, splitting and indexing
+    each job in the background while the next one renders
+    """
+    args = run.args
+    jobs = list(run.jobs())
+    eta = RenderETA(run.audio_seconds(jobs))
+
+    with BackgroundWorker(max_pending=args.pipeline_depth) as postprocess:
+        for job in jobs:
+            rendered_file = None
+            if job.render_indices:
+                audio_seconds = run.audio_seconds([job])
+                with telemetry.stage('render', job.unit, job.sweep_name, settings=len(job.render_indices),
+                                     audio_seconds=audio_seconds) as event:
+                    rendered_file = render_job(job, run.clip_len, backend, run.config, args)
+                    event['bytes_written'] = rendered_file.stat().st_size
+                eta.update(audio_seconds)
+                report_progress(eta)
+            postprocess.submit(run.finish, job, rendered_file)
+
+    run.close()
+
+
+def report_progress(eta) -> None:
+    """
+    Logs the measured render speed and the estimated time left
+    """
+    msg(f"Rendered {seconds_to_str(eta.done)} of {seconds_to_str(eta.total)} of audio "
+        f"at {eta.speed:.2f}x realtime, about {seconds_to_str(eta.remaining)} left")
 
 
-def render_data(sweep, clip_len, project, vst_name, default_values, args):
-#    print(list(sweep))
-    # Delete all old tracks (and therefore the VST and envelopes)
-    for track in project.tracks:
-        track.delete()
-    project.cursor_position = 0
+def generate_data_pool(arg_sets, ports, render_root, telemetry=None):
+    """
+    Renders several (DI, config) pairs across a pool of local REAPER
+    instances (or offline backends, one per port).  Jobs from all pairs are sharded over the instances,
+    each of which renders into its own directory, and are completed
+    in order as their results come back.
 
-#    warmup(args.di_file, project)
-    num_settings = len(sweep)
+    Args:
+            arg_sets (List[argparse]): The configuration options of each (DI, config) pair
+            ports (List[int]): The web interface port of each REAPER instance
+            render_root (Path): The directory holding each instance's render directory
+            telemetry (Telemetry): Receives the timing events of each stage
 
-    # Loop DI to match the number of settings changes
-    if args.copy_method == "sox":
-        # copy via calls out to sox
-        copy_DI_sox(project,
-                    infile=args.di_file,
-                    outfile=args.output_dir / args.sox_di_name,
-                    times=num_settings,
-                    margin=args.margin)
-    else:
-        # copy via Reapy
-        copy_DI_reapy(project,
-                      args.di_file, 
-                      times=num_settings,
-                      margin=args.margin)
+    Returns:
+        None
+    """
+    telemetry = telemetry or Telemetry()
+    runs = []
+    for args in arg_sets:
+        config = SweepConfig(args.conf_file)
+        runs.append(RenderRun(args, config, read_wav_info(args.di_file).duration, telemetry))
+    jobs = [(run, job) for run in runs for job in run.jobs()]
+    tasks = [(run.args, run.config, run.clip_len, job) for run, job in jobs]
+    eta = RenderETA(sum(run.audio_seconds([job]) for run, job in jobs))
+    connect = BACKENDS[arg_sets[0].backend].connect
+    with InstancePool(ports, render_root, connect) as pool:
+        for (run, job), (checksum, events) in zip(jobs, pool.imap(render_pool_job, tasks)):
+            # Events were timed in the worker, and are recorded here
+            for event in events:
+                telemetry.emit(event)
+            if job.render_indices:
+                eta.update(run.audio_seconds([job]))
+                report_progress(eta)
+            run.complete(job, checksum)
+    for run in runs:
+        run.close()
+
+
+def render_pool_job(task):
+    """
+    Renders and splits one job on the instance of this pool worker, and
+    returns the checksum of its clips and its telemetry events
+    """
+    args, config, clip_len, job = task
+    if not job.render_indices:
+        return None, []
+    # Keep this instance's renders apart from the others'
+    instance = current_instance()
+    args = argparse.Namespace(**{**vars(args), 'reaper_dir': instance['render_dir']})
+    # Each worker keeps its backend, so sessions carry over between its jobs
+    if 'backend' not in instance:
+        instance['backend'] = make_backend(args)
+    telemetry = Telemetry(collect=True)
+    with telemetry.stage('render', job.unit, job.sweep_name, settings=len(job.render_indices),
+                         audio_seconds=len(job.render_indices) * (clip_len + args.margin)) as event:
+        rendered_file = render_job(job, clip_len, instance['backend'], config, args)
+        event['bytes_written'] = rendered_file.stat().st_size
+    checksum = split_job(job, clip_len, rendered_file, args, telemetry)
+    for event in telemetry.collected:
+        event['instance'] = instance['port']
+    return checksum, telemetry.collected
+
+
+def render_job(job, clip_len, backend, config, args) -> Path:
+    """
+    Renders one job and returns the rendered file
 
+    Args:
+            job (RenderJob): The job to render
+            clip_len (float): The length in seconds of each clip
+            backend (RenderBackend): The host that renders the FX
+            config (SweepConfig): The VST config
+            args (argparse): The configuration options
 
-#    clip_len = int(project.cursor_position / num_settings)
+    Returns:
+        Path: the rendered file
+    """
+    # Print stats on sweep beforehand
+    if args.verbose:
+        time_in_seconds = len(job.sweep) * clip_len
+        size_in_mb = byte_to_str(time_in_seconds * args.mb_per_second)
+        msg(f"Performing sweep {job.unit}")
+        msg(f"Beginning sweep of {len(job.sweep)} settings, recording {clip_len}s of each.")
+        msg(f"This will create roughly {seconds_to_str(time_in_seconds)} ({size_in_mb}) of audio.")
+    return render_data(job.sweep, clip_len, backend, config.vst_name, config.default_values(), args)
 
 
-    # Now that there is a track of audio, reference it
-    track = project.tracks[0]
+def render_data(sweep, clip_len, backend, vst_name, default_values, args) -> Path:
+    """
+    Renders a sweep (one setting per loop of the DI) and returns the rendered file
 
-    # Load VST
-    fx = track.add_fx(vst_name) #config.vst_name)
-#    fx.make_online()
-    fx.open_ui()
+    Args:
+            sweep (Sweep): The settings to render
+            clip_len (float): The length in seconds of each clip
+            backend (RenderBackend): The host that renders the FX
+            vst_name (str): The FX to load
+            default_values (Dict[str, float]): The FX parameters that are not swept
+            args (argparse): The configuration options
 
+    Returns:
+        Path: the rendered file
+    """
+    session = (vst_name, sorted(default_values.items()))
+    if args.reuse_session and backend.session == session:
+        # Keep the loaded (and warmed up) VST, only swap media and envelopes
+        backend.clear()
+        backend.place_media(args.di_file, times=len(sweep), margin=args.margin)
+    else:
+        # Delete all old tracks (and therefore the VST and envelopes)
+        backend.reset()
 
-    # Read VST params
-    fx_number = 0
-    if args.verbose:
-        msg("Collecting parameters...")
-    tunable_parameters = sweep[0].keys()
-    name2env = get_fx_envelopes(track, 
-                                tunable_parameters, #[p.name for p in config.tunable_parameters()], 
-                                fx_number,
-                                threshold=args.max_vst_params)
-    print("Found params")
-    for pname in name2env.keys():
-        print(pname)
-    print()
-
-    # Set default VST param values from yaml
-    plist = track.fxs[fx_number].params
-
-    for pname, pvalue in default_values.items(): #config.default_values().items():
-        try:
-            plist[pname] = pvalue
-        except:
-            if args.verbose:
-                msg("Warning, error setting default value for: ", pname)
+        # Loop DI to match the number of settings changes
+        backend.place_media(args.di_file, times=len(sweep), margin=args.margin)
+
+        # Load VST
+        backend.load_fx(vst_name)
 
+        # Set default VST param values from yaml
+        for pname in backend.set_defaults(default_values):
+            if args.verbose:
+                msg(f"Warning, error setting default value for: {pname}")
+        backend.session = session
 
     # Specify sweeps over parameters as changes in FX param envelopes
     if args.verbose:
         msg("Setting envelopes...")
-    time = 0
-    for setting in sweep:
-        for param_name, param_val in setting.items():
-            try:
-                RPR.InsertEnvelopePoint(name2env[param_name], time, param_val, 1, 0, False, True)
-            except KeyError:
-                msg(f"Parameter {param_name} from the config file not found in VST.")
-                msg("List of VST keys found:")
-                for k in name2env.keys():
-                    msg(f"  {k}")
-        time += clip_len
-        time += args.margin
-
-
-    # Warmup / required to fix audio glitch at the start of
-    # recording in some environments
-    if args.warmup_time > 0:
-        import time
-        project.cursor_position = 0
-        project.play()
-        time.sleep(args.warmup_time)
-        project.pause()
-        project.cursor_position = 0
-
+    times = np.arange(len(sweep)) * (clip_len + args.margin)
+    found = backend.program_envelopes(sweep.columns, times, sweep.table)
+    if args.verbose:
+        msg("Found params")
+        for pname in found:
+            msg(pname)
+        msg("")
+    for param_name in sweep.columns:
+        if param_name not in found:
+            msg(f"Parameter {param_name} from the config file not found in VST.")
+            msg("List of VST keys found:")
+            for k in found:
+                msg(f"  {k}")
 
     # Render file
     if args.verbose:
         msg("Rendering...")
-    RPR.Main_OnCommand(42230, 0)
+    return backend.render()
+
+
+def delete_tmp(clip_len, args) -> bool:
+    """
+    Whether temp files are deleted right away: on request, and always when
+    renders are bounded, to cap temp disk use
+    """
+    return args.delete_tmp_files or settings_per_render(clip_len, args) > 0
+
+
+def split_job(job, clip_len, rendered_file, args, telemetry) -> str:
+    """
+    Splits the rendered file of a job into its clips, as one split event
+    """
+    with telemetry.stage('split', job.unit, job.sweep_name, settings=len(job.render_indices),
+                         audio_seconds=len(job.render_indices) * (clip_len + args.margin)) as event:
+        with make_shard_writer(args) or nullcontext() as shards:
+            checksum = split_data(args, clip_len, rendered_file, job.render_indices, shards)
+        event['bytes_written'] = clips_size(args, job.render_indices, shards)
+    return checksum
 
 
-def split_data(args, clip_len, num_settings, idx_offset):
+def make_shard_writer(args):
+    """
+    The ShardWriter packing the clips of one split, with --shard_size_mb, or None
+    """
+    if args.shard_size_mb <= 0:
+        return None
+    return ShardWriter(args.output_dir / SHARD_DIR, int(args.shard_size_mb * 2 ** 20),
+                       num_workers=args.split_workers, fsync=args.fsync)
+
+
+def clips_size(args, file_indices, shards) -> int:
+    """
+    The bytes written by a split, into the given ShardWriter or as clip files
+    """
+    if shards is not None:
+        return shards.bytes_written
+    suffix = make_encoding(args).suffix
+    return sum(clip_path(args.output_dir, i, suffix).stat().st_size for i in file_indices)
+
+
+def split_data(args, clip_len, rendered_file, file_indices, shards=None) -> str:
     # Postprocess the rendered file
     if args.verbose:
         msg("Processing rendered file...")
 
-    # Identify the most recent .wav in Reaper output dir
-    reaper_output_files = args.reaper_dir.glob('*.wav')
-    rendered_file = max(reaper_output_files, key=lambda p: p.stat().st_ctime)
-
     # Split into chunks into the provided new output dir
-    split_audio(rendered_file, clip_len + args.margin, args.output_dir, idx_offset)
+    checksum = split_audio(rendered_file, clip_len + args.margin, args.output_dir,
+                indices=file_indices,
+                num_workers=args.split_workers,
+                fsync=args.fsync,
+                encoding=make_encoding(args),
+                shards=shards,
+                verbose=args.verbose)
 
     # Clean up
-    if args.delete_tmp_files:
+    if delete_tmp(clip_len, args):
         if args.verbose:
             msg("Deleting tmp files...")
-        delete_tmp_files([rendered_file,                            # Output of REAPER
-                          args.output_dir / args.sox_di_name,       # Output of SoX
-                          args.output_dir / f"{num_settings+idx_offset:08d}.wav" # Excess audio from splitting
-                          ],
-                          verbose=args.verbose)
+        delete_tmp_files([rendered_file],                           # Output of REAPER
+                         verbose=args.verbose)
 
     if args.verbose:
         msg("Done.\n")
+    return checksum
 
 
 
@@ -236,33 +634,100 @@ if __name__ == '__main__':
     parser.add_argument('--output_dir', type=Path, required=True,
                         help="the (root) directory where data will be written")
     parser.add_argument('--reaper_dir', type=Path, required=True,
-                        help="the directory Reaper writes files to")
-    parser.add_argument('--copy_method', type=str, choices=['sox', 'reapy'],
-                        help="the method used to copy the DI for each sweep")
+                        help="the directory REAPER renders to (each render is given its own file name there)")
+    parser.add_argument('--backend', type=str, choices=list(BACKENDS), default='reaper',
+                        help="the host that renders the FX: a running REAPER instance, or an offline stand-in that applies a deterministic parameter-dependent transform (for testing and benchmarking without REAPER)")
+    parser.add_argument('--copy_method', type=str, choices=['loop', 'tile', 'sox', 'reapy'],
+                        help="the method used to copy the DI for each sweep: 'loop' inserts the margin-padded DI once as a looping item, 'tile' (or its old name 'sox') inserts one looped DI written in process, 'reapy' inserts the DI once per setting")
+    parser.add_argument('--di_cache_dir', type=Path, default=None,
+                        help="directory of looped and padded DIs written by the 'loop' and 'tile' copy_methods, reused across configs, sweeps, runs and REAPER instances.  If not given, only the looped DI in use is kept, in di_cache in --reaper_dir")
+    parser.add_argument('--di_cache_mb', type=float, default=-1,
+                        help="size limit of --di_cache_dir, kept by evicting the least recently used looped DIs (default is no limit)")
     parser.add_argument('--margin', type=float, default=0.1,
                         help="amount of blank audio between DIs in seconds")
     parser.add_argument('--delete_tmp_files', type=bool, default=False,
                         help="delete the intermediary files made during rendering")
     parser.add_argument('--mb_per_second', type=int, default=139810,
                         help="constant used for estimating diskspace requirement")
-    parser.add_argument('--sox_di_name', type=str, default="full_di.wav",
-                        help="name of the generated long DI file if using SoX copy_method")
     parser.add_argument('--copy_di', type=bool, default=True, 
                         help="copy the DI file to the output_dir for future reference")
     parser.add_argument('--warmup_time', type=int, default=15,
                         help="amount of seconds to play the track prior to recording to prevent audio glitches")
+    parser.add_argument('--warmup_mode', type=str, choices=['fixed', 'stable'], default='fixed',
+                        help="'fixed' plays for --warmup_time seconds, 'stable' plays until the output level settles, for at most --warmup_time seconds")
+    parser.add_argument('--reuse_session', type=bool, default=False,
+                        help="keep the VST loaded (and warmed up) across sweeps and configs with the same VST and defaults, clearing only media and envelopes between them")
     parser.add_argument('--verbose', type=bool, default=False,
                         help="whether to print logging information")
     parser.add_argument('--max_vst_params', type=int, default=-1,
                         help="max number of params to probe from VST.  Many higher range params are often for MIDI CC routing with can slow down processing.")
+    parser.add_argument('--max_settings_per_render', type=int, default=-1,
+                        help="split each sweep into render jobs of at most this many settings, deleting each job's temp files once split")
+    parser.add_argument('--max_render_seconds', type=float, default=-1,
+                        help="split each sweep into render jobs of at most this many seconds of audio, deleting each job's temp files once split")
+    parser.add_argument('--pipeline_depth', type=int, default=1,
+                        help="number of rendered jobs that may wait to be split in the background while the next job renders (0 splits each job before rendering the next)")
+    parser.add_argument('--reaper_ports', type=str, default=None,
+                        help="comma separated web interface ports of several running REAPER instances to shard rendering across")
+    parser.add_argument('--render_root', type=Path, default=None,
+                        help="directory for the per-instance render directories when using --reaper_ports (default is --reaper_dir)")
+    parser.add_argument('--multi_di', type=bool, default=False,
+                        help="render all DIs of --di_file against each config in one pass, with every DI back to back in each setting's slot (DIs must share a sample format)")
+    parser.add_argument('--schema_cache_dir', type=Path, default=None,
+                        help="directory to cache each VST's parameter names, indices and ranges across sweeps and runs")
     parser.add_argument('--max_samples', type=int, default=-1,
                         help="max number of samples.  If less than total specified sweeps, sample uniformly.")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="random seed used when sampling settings with --max_samples")
+    parser.add_argument('--sampling', type=str, choices=SAMPLING_METHODS, default='uniform',
+                        help="how settings are chosen with --max_samples: uniformly at random, or by Latin hypercube (lhs), scrambled Sobol (sobol) or jittered grid strata over the parameters (stratified), snapped to each parameter's grid")
+    parser.add_argument('--split_workers', type=int, default=4,
+                        help="number of threads writing split clips to disk")
+    parser.add_argument('--fsync', type=bool, default=False,
+                        help="flush each split clip to disk as it is written")
+    parser.add_argument('--clip_codec', type=str, choices=list(CODECS), default='wav',
+                        help="how split clips are written: 'wav', 'flac' (requires soundfile) or 'raw' headerless little-endian float32 (.f32, described by clip_format.json)")
+    parser.add_argument('--clip_sample_format', type=str, choices=list(SAMPLE_FORMATS), default=None,
+                        help="sample format of split clips (default is the render's, or pcm24 for FLAC of a float render)")
+    parser.add_argument('--clip_sample_rate', type=int, default=None,
+                        help="resample split clips to this rate, with a polyphase filter (requires scipy; default is the render's rate)")
+    parser.add_argument('--mono', type=bool, default=False,
+                        help="downmix split clips to mono")
+    parser.add_argument('--shard_size_mb', type=float, default=-1,
+                        help="pack split clips into shards of about this many MB in output_dir/shards, with an offset index mapping each file index to its shard, offset and length, instead of writing one file per clip (-1)")
+    parser.add_argument('--index_format', type=str, default='yaml',
+                        help=f"comma separated formats of the settings index to write, from {', '.join(INDEX_FORMATS)}")
+    parser.add_argument('--cache_dir', type=Path, default=None,
+                        help="directory of a content-addressed render cache.  If given, settings already rendered in this or a previous run are linked from the cache instead of rendered again")
+    parser.add_argument('--telemetry_file', type=Path, default=None,
+                        help="JSON-lines file to append per-stage timing and throughput events to")
+    parser.add_argument('--prometheus_file', type=Path, default=None,
+                        help="Prometheus textfile to keep per-stage totals in (e.g. for the node exporter's textfile collector)")
     parser.add_argument('--logging', type=str, choices=['stdout', 'console', 'both'], default='stdout',
                         help="destination of logging messages (default is 'stdout', but can also print to REAPER 'console'.")
     args = parser.parse_args()
+    if args.multi_di and args.reaper_ports:
+        parser.error("--multi_di cannot be combined with --reaper_ports")
+    try:
+        make_encoding(args)
+    except ValueError as e:
+        parser.error(str(e))
+    # Check the index formats now, as the index is only written once rendering is done
+    index_formats = args.index_format.split(',')
+    for index_format in index_formats:
+        if index_format not in INDEX_FORMATS:
+            parser.error(f"unknown --index_format '{index_format}', choose from {', '.join(INDEX_FORMATS)}")
+    if 'parquet' in index_formats:
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("--index_format parquet requires pyarrow (pip install pyarrow)")
+    if args.shard_size_mb > 0 and args.clip_codec == 'flac':
+        parser.error("--shard_size_mb packs raw samples, and cannot be combined with --clip_codec flac")
+    if args.shard_size_mb > 0 and args.cache_dir is not None:
+        parser.error("--shard_size_mb cannot be combined with --cache_dir, which links clip files")
 
     # Set the logging mode
-    global MSG_MODE
     MSG_MODE = args.logging
 
 
@@ -276,8 +741,11 @@ if __name__ == '__main__':
         conf_files = [args.conf_file]
 
 
+    telemetry = Telemetry(args.telemetry_file, args.prometheus_file)
+
     # Loop through all given DI and conf files
     root_output_dir = args.output_dir
+    arg_sets = []
     for di_file in di_files:
         for conf_file in conf_files:
             config = SweepConfig(conf_file)
@@ -295,7 +763,22 @@ if __name__ == '__main__':
             print(args.__dict__['output_dir'])
             if args.verbose:
                 print(args)
-            generate_data(args)
+            if args.reaper_ports or args.multi_di:
+                arg_sets.append(argparse.Namespace(**vars(args)))
+            else:
+                generate_data(args, telemetry)
+
+    # Shard all the (DI, config) pairs over a pool of REAPER instances
+    if args.reaper_ports:
+        generate_data_pool(arg_sets,
+                           ports=[int(p) for p in args.reaper_ports.split(',')],
+                           render_root=args.render_root or args.reaper_dir,
+                           telemetry=telemetry)
+
+    # Render each config once, covering all the DIs
+    if args.multi_di:
+        for conf_file in conf_files:
+            generate_data_multi([a for a in arg_sets if a.conf_file == conf_file], telemetry)
 
 
 
@@ -0,0 +1,237 @@
+# Times each stage of the data generation pipeline on synthetic configs and DIs
+#
+# Every (stage, size) pair runs in a fresh subprocess, so that its peak RSS
+# is its own (the larger of the stage process and any worker processes it
+# started).  Audio stages render through the offline backend, and are
+# capped at --max_audio_settings clips per size, so the render and
+# envelope_chunks stages measure the offline stand-in, not REAPER.
+#
+# Example:
+#     $ python scripts/benchmark_stages.py --sizes 10,1000,100000,1000000 --output bench.json
+
+import sys
+import json
+import math
+import time
+import resource
+import platform
+import argparse
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sweeps import Sweeper, SweepConfig, SAMPLING_METHODS
+from wav_helpers import WAVE_FORMAT_PCM, make_fmt_chunk, write_wav_header, tile_wav
+from file_helpers import split_audio
+from backends import OfflineBackend
+from reaper_helpers import envelope_state_chunk
+
+STAGES = ['config_parse', 'sweep_enumerate', 'sweep_sample', 'di_loop', 'render', 'envelope_chunks',
+          'split', 'write_yaml', 'write_npz', 'hf_convert', 'hf_convert_streaming']
+
+# The most values a ParamSweep grid can have (steps of 0.01 from 0 to 1)
+MAX_PARAM_VALUES = 100
+
+# An envelope state chunk as REAPER returns it for a fresh FX parameter envelope
+ENVELOPE_CHUNK = "<PARMENV 0 0 1 0\nACT 1 -1\nVIS 1 1 1\nLANEHEIGHT 0 0\nARM 0\nDEFSHAPE 0 -1 -1\n>\n"
+
+# Stages that run against the offline backend rather than REAPER
+STAND_IN_STAGES = {'render': "offline backend render, not REAPER",
+                   'envelope_chunks': "builds envelope state chunks only, no REAPER envelope writes"}
+
+
+def make_config(conf_file, size):
+    """
+    Writes a single-sweep SweepConfig with at least size settings, over
+    as few parameters as the grid resolution allows
+    """
+    counts = []
+    remaining = size
+    while remaining > 1:
+        counts.append(min(MAX_PARAM_VALUES, remaining))
+        remaining = math.ceil(remaining / counts[-1])
+    counts = counts or [1]
+    # The max is nudged past the last value so its grid index survives int(x * 100)
+    params = [{'name': [f"Param {i + 1}"], 'min': 0.0, 'max': round((c - 1) / 100 + 0.001, 3), 'step': 0.01}
+              for i, c in enumerate(counts)]
+    defaults = [{'name': f"Param {i + 1}", 'value': 0.5} for i in range(len(counts))]
+    defaults += [{'name': f"Fixed {i + 1}", 'value': 0.25} for i in range(8)]
+    config = {'brand': "Bench", 'vst': "Bench FX", 'device': f"Bench {size}",
+              'device_type': "Synthetic", 'data_type': "Simulation",
+              'sweeps': [{'comment': f"Bench {size}", 'params': params}],
+              'defaults': defaults}
+    with open(conf_file, "w") as outfile:
+        yaml.safe_dump(config, outfile, sort_keys=False)
+
+
+def make_di(di_file, clip_len, sample_rate):
+    """
+    Writes a mono 16-bit DI of a decaying, detuned pair of tones plus noise
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(round(clip_len * sample_rate)) / sample_rate
+    x = (np.sin(2 * np.pi * 110 * t) + 0.5 * np.sin(2 * np.pi * 165.5 * t)) * np.exp(-2 * t) * 0.5
+    x += 0.01 * rng.standard_normal(len(t))
+    data = np.clip(np.round(x * 32767), -32768, 32767).astype('<i2').tobytes()
+    with open(di_file, "wb") as out:
+        write_wav_header(out, make_fmt_chunk(WAVE_FORMAT_PCM, 1, sample_rate, 16), len(data))
+        out.write(data)
+
+
+def run_stage(stage, size, work_dir, args):
+    """
+    Runs the untimed setup and then the timed body of one stage
+
+    Returns:
+        dict: the stage result, with wall time and items processed
+    """
+    conf_file = work_dir / f"config-{size}.yaml"
+    di_file = work_dir / "di.wav"
+    stage_dir = work_dir / f"{stage}-{size}"
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    n_audio = min(size, args.max_audio_settings)
+    config = SweepConfig(conf_file) if stage != 'config_parse' else None
+    backend = OfflineBackend(stage_dir)
+
+    if stage == 'envelope_chunks':
+        sweep = Sweeper(config, -1, verbose=False).sweeps[0][1]
+    if stage in ('render', 'split'):
+        backend.place_media(di_file, times=n_audio, margin=args.margin)
+    if stage == 'split':
+        rendered_file = backend.render()
+    if stage.startswith('hf_convert'):
+        # A device folder with one rendered DI's settings index
+        hf_dir = stage_dir / "device"
+        (hf_dir / "di").mkdir(parents=True, exist_ok=True)
+        Sweeper(config, -1, verbose=False).write(hf_dir / "di" / "settings.yaml", di_file)
+        from huggingface_preprocessor import convert2huggingface, convert2huggingface_streaming
+
+    start = time.perf_counter()
+    if stage == 'config_parse':
+        SweepConfig(conf_file)
+        items = size
+    elif stage == 'sweep_enumerate':
+        items = 0
+        for _, sweep in Sweeper(config, -1, verbose=False).sweeps:
+            items += len(sweep.table)
+    elif stage == 'sweep_sample':
+        k = max(size // args.sample_divisor, 1)
+        sampled = Sweeper(config, k, seed=0, sampling=args.sampling, verbose=False)
+        items = sum(len(s.table) for _, s in sampled.sweeps)
+    elif stage == 'di_loop':
+        # What the 'tile' copy method does before inserting the DI
+        tile_wav(di_file, stage_dir / "looped.wav", n_audio, args.margin)
+        items = n_audio
+    elif stage == 'render':
+        backend.render()
+        items = n_audio
+    elif stage == 'envelope_chunks':
+        times = np.arange(len(sweep)) * (args.clip_len + args.margin)
+        for param_vals in sweep.table.T:
+            envelope_state_chunk(ENVELOPE_CHUNK, times.tolist(), param_vals.tolist())
+        backend.program_envelopes(sweep.columns, times, sweep.table)
+        items = len(sweep)
+    elif stage == 'split':
+        split_audio(rendered_file, args.clip_len + args.margin, stage_dir / "clips",
+                    indices=range(n_audio), num_workers=args.split_workers)
+        items = n_audio
+    elif stage == 'write_yaml':
+        Sweeper(config, -1, verbose=False).write(stage_dir / "settings.yaml", di_file)
+        items = size
+    elif stage == 'write_npz':
+        Sweeper(config, -1, verbose=False).write(stage_dir / "settings.npz", di_file)
+        items = size
+    elif stage == 'hf_convert':
+        convert2huggingface(hf_dir)
+        items = size
+    elif stage == 'hf_convert_streaming':
+        convert2huggingface_streaming(hf_dir, workers=args.hf_workers)
+        items = size
+    wall = time.perf_counter() - start
+
+    # Worker processes (e.g. of hf_convert_streaming) count once they are
+    # joined; ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    peak_rss_mb = peak_rss / (1 << 20) if sys.platform == 'darwin' else peak_rss / 1024
+    result = {'stage': stage, 'size': size, 'items': items, 'wall_s': wall,
+              'peak_rss_mb': peak_rss_mb, 'items_per_s': items / wall if wall > 0 else None}
+    if stage in STAND_IN_STAGES:
+        result['stand_in'] = STAND_IN_STAGES[stage]
+    return result
+
+
+def main(args):
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    sizes = [int(s) for s in args.sizes.split(',')]
+    stages = args.stages.split(',') if args.stages else STAGES
+    make_di(args.work_dir / "di.wav", args.clip_len, args.sample_rate)
+    for size in sizes:
+        make_config(args.work_dir / f"config-{size}.yaml", size)
+
+    results = []
+    for size in sizes:
+        for stage in stages:
+            cmd = [sys.executable, __file__, '--run_stage', stage, '--size', str(size)] + sys.argv[1:]
+            process = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                result = {'stage': stage, 'size': size, 'error': process.returncode}
+            else:
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    report = {'python': platform.python_version(),
+              'machine': platform.machine(),
+              'system': platform.system(),
+              'clip_len': args.clip_len,
+              'sample_rate': args.sample_rate,
+              'margin': args.margin,
+              'max_audio_settings': args.max_audio_settings,
+              'results': results}
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of data generation.')
+    parser.add_argument('--sizes', type=str, default='10,1000,100000,1000000',
+                        help='comma separated numbers of settings in the synthetic configs')
+    parser.add_argument('--stages', type=str, default=None,
+                        help=f"comma separated stages to run, from {', '.join(STAGES)} (default is all)")
+    parser.add_argument('--work_dir', type=Path, default=Path('bench_work'),
+                        help='directory for the synthetic configs, DI and stage outputs')
+    parser.add_argument('--output', type=Path, default=None,
+                        help='file to write the JSON results to (default is stdout)')
+    parser.add_argument('--clip_len', type=float, default=0.5,
+                        help='length in seconds of the synthetic DI')
+    parser.add_argument('--sample_rate', type=int, default=44100,
+                        help='sample rate of the synthetic DI')
+    parser.add_argument('--margin', type=float, default=0.1,
+                        help='amount of blank audio between DIs in seconds')
+    parser.add_argument('--max_audio_settings', type=int, default=1000,
+                        help='cap on the number of clips rendered or split by the audio stages')
+    parser.add_argument('--sampling', type=str, choices=SAMPLING_METHODS, default='uniform',
+                        help='sampling method timed by the sweep_sample stage')
+    parser.add_argument('--sample_divisor', type=int, default=10,
+                        help='the sweep_sample stage samples size // sample_divisor settings')
+    parser.add_argument('--split_workers', type=int, default=4,
+                        help='number of threads writing split clips to disk')
+    parser.add_argument('--hf_workers', type=int, default=None,
+                        help='number of worker processes of the hf_convert_streaming stage')
+    parser.add_argument('--run_stage', type=str, choices=STAGES, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        print(json.dumps(run_stage(args.run_stage, args.size, args.work_dir, args)))
+    else:
+        main(args)
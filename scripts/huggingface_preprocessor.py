@@ -6,6 +6,13 @@ import yaml
 from pathlib import Path
 import subprocess
 import argparse
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from index_helpers import find_indexes, load_index
 
 def process_info(yaml_data, verbose=False):
     # print(yaml_data.keys())
@@ -30,16 +37,19 @@ def process_info(yaml_data, verbose=False):
 
 def convert2huggingface(base_dir, verbose = False):
     infos = []
-    for p in base_dir.rglob("*"):
+    for p in find_indexes(base_dir):
+        if verbose:
+            print(f"Processing {p}...")
         if p.suffix == '.yaml':
-            if verbose:
-                print(f"Processing {p}...")
             with open(str(p)) as infile:
-                for info in process_info(yaml.safe_load(infile), verbose):
-                    root_path = p.relative_to(base_dir.parent)
-                    info['di_file'] = str(root_path.parent / info['di_file'])
-                    info['filename'] = str(root_path.parent / info['filename'])
-                    infos.append(info)
+                rows = list(process_info(yaml.safe_load(infile), verbose))
+        else:
+            rows = load_index(p).rows()
+        for info in rows:
+            root_path = p.relative_to(base_dir.parent)
+            info['di_file'] = str(root_path.parent / info['di_file'])
+            info['filename'] = str(root_path.parent / info['filename'])
+            infos.append(info)
 
     all_keys = set()
     for info in infos:
@@ -85,6 +95,160 @@ def convert2huggingface(base_dir, verbose = False):
 #       cmd = f"zip -vr data.zip FM3\ -\ Axe-FX\ 5150\ Block/ -x "*.DS_Store""
 
 
+# Use the C YAML loader when PyYAML was built with libyaml
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Line patterns of the settings.yaml files written by Sweeper.write
+TOP_KEY = re.compile(r'^(\w+):')
+PARAM_KEY = re.compile(r'^\s+- "(.*)":')
+
+
+def scan_schema(index_file):
+    """
+    Collects the keys of an index file without parsing it, mapping each
+    key to 'str' for global info or 'float' for parameter values
+    """
+    schema = {'filename': 'str'}
+    if index_file.suffix == '.yaml':
+        with open(index_file) as infile:
+            for line in infile:
+                match = PARAM_KEY.match(line) or TOP_KEY.match(line)
+                if match is None:
+                    continue
+                key = match.group(1)
+                if match.re is TOP_KEY:
+                    if key not in ('files', 'defaults'):
+                        schema[key] = 'str'
+                else:
+                    schema.setdefault(key, 'float')
+    else:
+        index = load_index(index_file)
+        schema.update((k, 'str') for k in index.meta)
+        schema.update((k, 'float') for k in index.columns)
+    return schema
+
+
+def iter_rows(index_file, base_dir):
+    """
+    Yields the rows of a single index file, with paths relative to base_dir's parent
+    """
+    if index_file.suffix == '.yaml':
+        with open(index_file) as infile:
+            rows = process_info(yaml.load(infile, Loader=YAML_LOADER))
+    else:
+        rows = load_index(index_file).rows()
+    root_path = index_file.relative_to(base_dir.parent)
+    for info in rows:
+        info['di_file'] = str(root_path.parent / info['di_file'])
+        info['filename'] = str(root_path.parent / info['filename'])
+        yield info
+
+
+def write_part(index_file, base_dir, schema, part_file, output_format, batch_size):
+    """
+    Converts a single index file into a headerless CSV or a Parquet part
+    file, in batches of batch_size rows.  Runs in a worker process.
+    """
+    key_list = list(schema.keys())
+    num_rows = 0
+    if output_format == 'csv':
+        with open(part_file, "w") as out:
+            for info in iter_rows(index_file, base_dir):
+                out.write(",".join([str(info.get(k, "0")) for k in key_list]) + "\n")
+                num_rows += 1
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrow_schema = pa.schema([(k, pa.string() if t == 'str' else pa.float64()) for k, t in schema.items()])
+
+        def to_batch(rows):
+            columns = [[row.get(k) for row in rows] for k in key_list]
+            columns = [[None if v is None else str(v) for v in c] if schema[k] == 'str' else c
+                       for k, c in zip(key_list, columns)]
+            return pa.RecordBatch.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, arrow_schema)],
+                                              schema=arrow_schema)
+
+        with pq.ParquetWriter(part_file, arrow_schema) as writer:
+            rows = []
+            for info in iter_rows(index_file, base_dir):
+                rows.append(info)
+                if len(rows) == batch_size:
+                    writer.write_batch(to_batch(rows))
+                    num_rows += len(rows)
+                    rows = []
+            if rows:
+                writer.write_batch(to_batch(rows))
+                num_rows += len(rows)
+    return num_rows
+
+
+def convert2huggingface_streaming(base_dir, workers=None, output_format='csv', batch_size=10000, verbose=False):
+    """
+    Streaming version of convert2huggingface with constant memory in the
+    main process.  A cheap first pass discovers the union of keys, then
+    each index file is parsed and converted in a process pool, and the
+    converted parts are appended to the output in order.
+
+    Args:
+            base_dir (Path): The device folder containing the rendered data
+            workers (int): The number of worker processes (default: one per core)
+            output_format (str): 'csv' writes data.csv, 'parquet' writes data.parquet
+            batch_size (int): The number of rows per Parquet batch / row group
+
+    Returns:
+        None
+    """
+    index_files = find_indexes(base_dir)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Pass 1: schema discovery, with global info first
+        schema = dict()
+        for file_schema in pool.map(scan_schema, index_files):
+            for k, t in file_schema.items():
+                schema.setdefault(k, t)
+        schema = {**{k: t for k, t in schema.items() if t == 'str'},
+                  **{k: t for k, t in schema.items() if t == 'float'}}
+        key_list = list(schema.keys())
+        if verbose:
+            print(key_list)
+
+        # Pass 2: convert each file into a part, then append the parts in order
+        output_file = base_dir / f"data.{output_format}"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            futures = [pool.submit(write_part, p, base_dir, schema,
+                                   Path(tmp_dir) / f"{i:08d}.{output_format}", output_format, batch_size)
+                       for i, p in enumerate(index_files)]
+            num_rows = 0
+            if output_format == 'csv':
+                with open(output_file, "w") as out:
+                    out.write(",".join(key_list) + "\n")
+                    for i, (p, future) in enumerate(zip(index_files, futures)):
+                        num_rows += future.result()
+                        if verbose:
+                            print(f"Processed {p}")
+                        part_file = Path(tmp_dir) / f"{i:08d}.csv"
+                        with open(part_file) as part:
+                            shutil.copyfileobj(part, out)
+                        part_file.unlink()
+            else:
+                import pyarrow.parquet as pq
+                writer = None
+                for i, (p, future) in enumerate(zip(index_files, futures)):
+                    num_rows += future.result()
+                    if verbose:
+                        print(f"Processed {p}")
+                    part_file = Path(tmp_dir) / f"{i:08d}.parquet"
+                    part = pq.ParquetFile(part_file)
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_file, part.schema_arrow)
+                    for batch in part.iter_batches(batch_size=batch_size):
+                        writer.write_batch(batch)
+                    part_file.unlink()
+                if writer is not None:
+                    writer.close()
+    print(num_rows)
+    print(output_file)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Options for VST rendering.')
     parser.add_argument('--input_dir', type=Path, required=True,
@@ -93,11 +257,26 @@ if __name__ == '__main__':
     #                     help='the input directory, which should be the device name folder.')
     # parser.add_argument('--make_zip', type=bool, default=False,
     #                     help='will run extra shell commands to package the complete zip for upload (mac only)')
+    parser.add_argument('--streaming', type=bool, default=False,
+                        help='parse index files in a process pool and stream rows to the output with constant memory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes in streaming mode (default is one per core)')
+    parser.add_argument('--output_format', type=str, choices=['csv', 'parquet'], default='csv',
+                        help='output format in streaming mode')
+    parser.add_argument('--batch_size', type=int, default=10000,
+                        help='number of rows per output batch in streaming mode')
     args = parser.parse_args()
 
 
-    convert2huggingface(base_dir=args.input_dir, 
-                        # output_dir=args.output_dir,
-                        # make_zip=args.make_zip,
-                        verbose=True)
+    if args.streaming:
+        convert2huggingface_streaming(base_dir=args.input_dir,
+                                      workers=args.workers,
+                                      output_format=args.output_format,
+                                      batch_size=args.batch_size,
+                                      verbose=True)
+    else:
+        convert2huggingface(base_dir=args.input_dir, 
+                            # output_dir=args.output_dir,
+                            # make_zip=args.make_zip,
+                            verbose=True)
 
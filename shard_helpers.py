@@ -0,0 +1,204 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from utils import atomic_file, write_atomic
+
+# The directory of the shards in an output directory
+SHARD_DIR = "shards"
+
+# The consolidated offset index of all shards in a shard directory
+SHARD_INDEX_FILE = "index.npz"
+
+
+class ShardWriter:
+    """
+    Packs clips into large shard files instead of writing one file each.
+
+    A shard holds the sample data of consecutive clips back to back, with
+    no headers (the format is in clip_format.json), so it can be memory
+    mapped as one array.  Each shard is named after the file index of its
+    first clip, and is closed once it reaches shard_bytes.  Next to each
+    shard, a small .npz offset index maps the file index of every clip to
+    its byte offset and length.  Shards are written under a temporary
+    name (see utils.atomic_file) and renamed into place before their
+    index, so a shard with an index is always complete.
+
+    Clips may be submitted with a function that encodes them, which runs
+    on a pool of worker threads; they are appended in submission order,
+    with at most max_pending clips in flight.
+    """
+
+    def __init__(self, shard_dir: Path, shard_bytes: int, num_workers: int=1,
+                 max_pending: Optional[int]=None, fsync: bool=False):
+        self.shard_dir = shard_dir
+        self.shard_bytes = shard_bytes
+        self.fsync = fsync
+        self.pool = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+        self.max_pending = max_pending or 2 * max(num_workers, 1)
+        self.pending = deque()
+        self.bytes_written = 0
+        self.shard = None
+        shard_dir.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        # Delete the partial shard, which never gets an index
+        if self.shard is not None:
+            self.shard['files'].__exit__(exc_type, exc_value, traceback)
+
+    def add(self, file_idx: int, data: bytes) -> None:
+        self.pending.append((file_idx, data))
+        self.drain(self.max_pending)
+
+    def submit(self, file_idx: int, fn: Callable[..., bytes], *args) -> None:
+        """
+        Appends the clip returned by fn(*args), running fn on the worker threads
+        """
+        if self.pool is None:
+            self.add(file_idx, fn(*args))
+            return
+        self.pending.append((file_idx, self.pool.submit(fn, *args)))
+        self.drain(self.max_pending)
+
+    def drain(self, max_pending: int) -> None:
+        while len(self.pending) > max_pending:
+            file_idx, data = self.pending.popleft()
+            self.append(file_idx, data if isinstance(data, bytes) else data.result())
+
+    def append(self, file_idx: int, data: bytes) -> None:
+        if self.shard is not None and self.shard['size'] > 0 and self.shard['size'] + len(data) > self.shard_bytes:
+            self.finish_shard()
+        if self.shard is None:
+            path = self.shard_dir / f"shard-{file_idx:08d}.bin"
+            # The shard is written across many appends, so its files are closed in finish_shard
+            files = ExitStack()
+            tmp_file = files.enter_context(atomic_file(path))
+            self.shard = {'path': path, 'files': files, 'file': files.enter_context(open(tmp_file, "wb")),
+                          'size': 0, 'file_index': [], 'offset': [], 'length': []}
+        shard = self.shard
+        shard['file'].write(data)
+        shard['file_index'].append(file_idx)
+        shard['offset'].append(shard['size'])
+        shard['length'].append(len(data))
+        shard['size'] += len(data)
+        self.bytes_written += len(data)
+
+    def finish_shard(self) -> None:
+        shard, self.shard = self.shard, None
+        if self.fsync:
+            shard['file'].flush()
+            os.fsync(shard['file'].fileno())
+        # Closes the shard and renames it into place
+        shard['files'].close()
+        # The index goes last: it marks the shard as complete
+        save_npz(shard['path'].with_suffix('.npz'),
+                 file_index=np.array(shard['file_index'], dtype=np.int64),
+                 offset=np.array(shard['offset'], dtype=np.int64),
+                 length=np.array(shard['length'], dtype=np.int64))
+        self.bytes_written += shard['path'].with_suffix('.npz').stat().st_size
+
+    def close(self) -> None:
+        self.drain(0)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if self.shard is not None:
+            self.finish_shard()
+
+
+class ShardIndex:
+    """
+    The offset index of a shard directory: for every packed clip, its file
+    index, the shard holding it, and its byte offset and length there.
+    Entries are sorted by file index.
+    """
+
+    def __init__(self, file_index: np.ndarray, shard: np.ndarray, offset: np.ndarray, length: np.ndarray):
+        self.file_index = file_index
+        self.shard = shard
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.file_index)
+
+    @property
+    def shards(self) -> List[str]:
+        return sorted(set(self.shard.tolist()))
+
+    def covers(self, start: int, stop: int) -> bool:
+        """
+        Whether every file index in [start, stop) is packed
+        """
+        lo, hi = np.searchsorted(self.file_index, [start, stop])
+        return hi - lo == stop - start
+
+    def locate(self, file_indices) -> np.ndarray:
+        """
+        The entry of each of the given file indices
+        """
+        entries = np.searchsorted(self.file_index, file_indices)
+        entries = np.minimum(entries, len(self.file_index) - 1)
+        if len(self.file_index) == 0 or np.any(self.file_index[entries] != file_indices):
+            raise KeyError("File index not in the shard index")
+        return entries
+
+    @staticmethod
+    def scan(shard_dir: Path) -> 'ShardIndex':
+        """
+        Builds the index from the offset index of every complete shard.  If
+        a file index was packed more than once, the shard listed last wins.
+        """
+        parts = []
+        for index_file in sorted(Path(shard_dir).glob("shard-*.npz")):
+            with np.load(index_file) as part:
+                shard = np.full(len(part['file_index']), index_file.stem + ".bin")
+                parts.append((part['file_index'], shard, part['offset'], part['length']))
+        if not parts:
+            return ShardIndex(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=str),
+                              np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        file_index, shard, offset, length = (np.concatenate(a) for a in zip(*parts))
+        # Keep the last entry of each file index
+        order = np.argsort(file_index, kind='stable')[::-1]
+        _, last = np.unique(file_index[order], return_index=True)
+        keep = order[last]
+        return ShardIndex(file_index[keep], shard[keep], offset[keep], length[keep])
+
+    @staticmethod
+    def load(shard_dir: Path) -> 'ShardIndex':
+        """
+        Reads the consolidated index, or scans the shards if there is none
+        """
+        index_file = Path(shard_dir) / SHARD_INDEX_FILE
+        if not index_file.is_file():
+            return ShardIndex.scan(shard_dir)
+        with np.load(index_file) as index:
+            return ShardIndex(index['file_index'], index['shard'], index['offset'], index['length'])
+
+    def write(self, shard_dir: Path) -> None:
+        save_npz(Path(shard_dir) / SHARD_INDEX_FILE, file_index=self.file_index, shard=self.shard,
+                 offset=self.offset, length=self.length)
+
+
+def save_npz(path: Path, **arrays) -> None:
+    """
+    Writes arrays to an .npz file atomically
+    """
+    def write(tmp_file: Path) -> None:
+        # Through a file object, as np.savez would add .npz to the temporary name
+        with open(tmp_file, "wb") as outfile:
+            np.savez(outfile, **arrays)
+    write_atomic(path, write)
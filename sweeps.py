@@ -1,7 +1,11 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
+import warnings
+import numpy as np
 import yaml
 from pathlib import Path
-from random import sample
+from random import Random
+
+from index_helpers import SettingsIndex, write_index
 
 
 class SweepInfo:
@@ -19,54 +23,285 @@ class ParamSweep:
         self.max_val = max_val
         self.step = step
 
+    def values(self) -> List[float]:
+        mult = 100
+        return [v / mult for v in range(int(self.min_val * mult), int(self.max_val * mult) + 1, int(self.step * mult))]
+
+
+class Sweep:
+    """
+    A virtual sequence over the settings of a sweep.
+
+    The settings are the cartesian product of each ParamSweep's values, and
+    are never materialized: the k-th setting is decoded on demand from its
+    mixed-radix grid index, with the first ParamSweep varying fastest.
+    A Sweep may also be a view onto a subset of the grid, given as a
+    sequence of grid indices (e.g. after sampling or slicing).
+
+    For bulk consumers, the settings are also available as a settings
+    table: a float array of shape (len(sweep), len(columns)), where
+    columns is a tuple of parameter names shared by every setting.
+    """
+
+    def __init__(self, params: List[ParamSweep], indices: Optional[Sequence[int]]=None):
+        self.params = params
+        self.grid = [p.values() for p in params]
+        self.radices = [len(values) for values in self.grid]
+        self.grid_size = 1
+        for radix in self.radices:
+            self.grid_size *= radix
+        self.indices = range(self.grid_size) if indices is None else indices
+        # Each column takes its values from the first ParamSweep naming it
+        sources = dict()
+        for position in reversed(range(len(params))):
+            for pname in params[position].names:
+                sources[pname] = position
+        self.columns: Tuple[str, ...] = tuple(sources.keys())
+        self.column_sources = tuple(sources.values())
+        self._table = None
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return Sweep(self.params, self.indices[k])
+        return self.setting(self.indices[k])
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.setting(index)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+    @property
+    def table(self) -> np.ndarray:
+        """
+        The settings of this sweep as a (len(sweep), len(columns)) float array
+        """
+        if self._table is None:
+            if isinstance(self.indices, range):
+                indices = np.arange(self.indices.start, self.indices.stop, self.indices.step, dtype=np.int64)
+            else:
+                indices = np.asarray(self.indices, dtype=np.int64)
+            # Mixed-radix decode of every index at once; the first param varies fastest
+            digits = np.unravel_index(indices, tuple(reversed(self.radices)))[::-1] if len(indices) else [indices] * len(self.radices)
+            table = np.empty((len(indices), len(self.columns)), dtype=np.float64)
+            for c, position in enumerate(self.column_sources):
+                table[:, c] = np.asarray(self.grid[position], dtype=np.float64)[digits[position]]
+            self._table = table
+        return self._table
+
+    def setting(self, index: int) -> Dict[str, float]:
+        """
+        Decodes a grid index into the parameter values of that setting
+        """
+        digits = []
+        for radix in self.radices:
+            index, digit = divmod(index, radix)
+            digits.append(digit)
+        setting = dict()
+        # Later params are outermost, and so come first in the setting
+        for param, values, digit in reversed(list(zip(self.params, self.grid, digits))):
+            for pname in param.names:
+                setting[pname] = values[digit]
+        return setting
+
+    def take(self, positions: Sequence[int]) -> 'Sweep':
+        """
+        A view onto the settings at the given positions of this sweep
+        """
+        return Sweep(self.params, [self.indices[p] for p in positions])
+
+    def sample(self, k: int, rng: Random, method: str='uniform') -> 'Sweep':
+        """
+        Samples k settings without replacement, without materializing the grid.
+
+        Besides uniform sampling, the space-filling methods in SAMPLING_METHODS
+        draw points in the unit hypercube (one dimension per ParamSweep), snap
+        them to each ParamSweep's grid, and top up any duplicate settings with
+        uniform draws.  These always sample from the sweep's full grid.
+        """
+        if method == 'uniform':
+            return Sweep(self.params, rng.sample(self.indices, k))
+        points = unit_samples(method, k, len(self.params), rng.randrange(2**32))
+        radices = np.array(self.radices)
+        digits = np.minimum((points * radices).astype(np.int64), radices - 1)
+        indices = np.ravel_multi_index(tuple(digits.T[::-1]), tuple(reversed(self.radices)))
+        # Snapping may map several points onto one setting, so drop repeats
+        _, first = np.unique(indices, return_index=True)
+        chosen = indices[np.sort(first)].tolist()
+        seen = set(chosen)
+        while len(chosen) < k:
+            index = rng.randrange(self.grid_size)
+            if index not in seen:
+                seen.add(index)
+                chosen.append(index)
+        return Sweep(self.params, chosen)
+
+
+SAMPLING_METHODS = ('uniform', 'lhs', 'sobol', 'stratified')
+
+
+def unit_samples(method: str, k: int, dims: int, seed: int) -> np.ndarray:
+    """
+    Draws k space-filling points in the unit hypercube [0, 1)^dims
+
+    Args:
+            method (str): 'lhs' for Latin hypercube, 'sobol' for scrambled Sobol
+                          (requires scipy), or 'stratified' for one jittered
+                          point in each cell of a grid of at most k cells
+                          (see grid_strata), plus jittered points in distinct
+                          random cells for the rest
+            k (int): The number of points
+            dims (int): The number of dimensions
+            seed (int): Seed for the random generator
+
+    Returns:
+        np.ndarray: a (k, dims) array of points
+    """
+    gen = np.random.default_rng(seed)
+    if method == 'lhs':
+        strata = np.stack([gen.permutation(k) for _ in range(dims)], axis=1)
+        return (strata + gen.random((k, dims))) / k
+    elif method == 'stratified':
+        # Fewer than n_cells points are left over, as a grid one stratum finer would exceed k
+        strata = grid_strata(k, dims)
+        n_cells = int(np.prod(strata))
+        cells = np.arange(min(k, n_cells))
+        if k > n_cells:
+            cells = np.concatenate([cells, gen.choice(n_cells, k - n_cells, replace=False)])
+        corners = np.stack(np.unravel_index(cells, strata), axis=1) if dims else np.zeros((len(cells), 0))
+        return (corners + gen.random((k, dims))) / strata
+    elif method == 'sobol':
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("Sobol sampling requires scipy (pip install scipy)")
+        with warnings.catch_warnings():
+            # Sobol balance warnings for sample counts that are not powers of 2
+            warnings.simplefilter("ignore", UserWarning)
+            return qmc.Sobol(d=dims, scramble=True, seed=gen).random(k)
+    raise ValueError(f"Unknown sampling method: {method}")
+
+
+def grid_strata(k: int, dims: int) -> np.ndarray:
+    """
+    The number of strata of each dimension of a grid of at most k cells, as
+    even across dimensions as possible (e.g. 3 x 3 for k=10, dims=2)
+    """
+    if dims == 0:
+        return np.ones(0, dtype=np.int64)
+    # Start from the largest even grid, then grow dimensions one stratum at a time
+    base = max(int(round(max(k, 1) ** (1 / dims))), 1)
+    while base > 1 and base ** dims > k:
+        base -= 1
+    strata = np.full(dims, base, dtype=np.int64)
+    while True:
+        d = np.argmin(strata)
+        if np.prod(strata) // strata[d] * (strata[d] + 1) > k:
+            break
+        strata[d] += 1
+    return strata
+
 
 class Sweeper:
 
 
-    def __init__(self, config, max_samples, verbose=True):
-        self.config = config        
-        self.sweeps = [(sw.comment, list(self.sweep_helper(sw.params))) for sw in config.infos]
+    def __init__(self, config, max_samples, seed: Optional[int]=None, sampling: str='uniform', verbose=True):
+        self.config = config
+        self.max_samples = max_samples
+        self.sampling = sampling
+        # Always sample from a known seed, so it can be recorded with the data
+        self.seed = seed if seed is not None else Random().randrange(2**32)
+        rng = Random(self.seed)
+        self.sweeps = [(sw.comment, Sweep(sw.params)) for sw in config.infos]
         for i in range(0, len(self.sweeps)):
             sweep_name, sweep = self.sweeps[i]
             if max_samples > -1 and len(sweep) > max_samples:
                 if verbose:
-                    print(f"Reducing the number of sweeps in {sweep_name},\n  {len(sweep)} -> {max_samples}")
-                sweep = sample(sweep, max_samples)
+                    print(f"Reducing the number of sweeps in {sweep_name},\n  {len(sweep)} -> {max_samples} ({sampling})")
+                sweep = sweep.sample(max_samples, rng, sampling)
                 self.sweeps[i] = sweep_name, sweep
 
 
-
-    def sweep_helper(self, param_list: List[ParamSweep]):
-        if len(param_list) > 1:
-            first, rest = param_list[0], param_list[1:]
-            settings = self.sweep_helper(rest) #, tied_params)
-        else:
-            first = param_list[0]
-            settings = [{}]
-
-        for setting in settings:
-            mult = 100
-            for v in range(int(first.min_val * mult), int(first.max_val * mult) + 1, int(first.step * mult)):
-                v = v / mult
-                z = {**setting, **{pname : v for pname in first.names}}
-                yield z
-
-
-    def write(self, out_file: Path, di_file: Path):
+    def header(self, di_file: Path) -> Dict[str, str]:
+        """
+        The global information recorded with every settings index
+        """
+        header = {'brand': self.config.brand_name,
+                  'vst_name': self.config.vst_name,
+                  'device': self.config.device_name,
+                  'device_type': self.config.device_type,
+                  'data_type': self.config.data_type,
+                  'di_file': di_file.name}
+        if self.max_samples > -1:
+            header['sampling'] = self.sampling
+            header['seed'] = self.seed
+        return header
+
+
+    def index(self, di_file: Path, suffix: str='.wav') -> SettingsIndex:
+        """
+        Builds the columnar settings index of all sweeps, numbered in render order
+        """
+        defaults = self.config.default_values()
+        columns = list(defaults.keys())
+        for sweep_name, sweep in self.sweeps:
+            columns += [c for c in sweep.columns if c not in defaults and c not in columns]
+        positions = {c: i for i, c in enumerate(columns)}
+        num_files = sum(len(sweep) for _, sweep in self.sweeps)
+        values = np.empty((num_files, len(columns)), dtype=np.float64)
+        values[:] = [defaults.get(c, np.nan) for c in columns]
+        offset = 0
+        for sweep_name, sweep in self.sweeps:
+            values[offset:offset + len(sweep), [positions[c] for c in sweep.columns]] = sweep.table
+            offset += len(sweep)
+        sweep_names = np.repeat(np.array([name for name, _ in self.sweeps], dtype=str),
+                                [len(sweep) for _, sweep in self.sweeps])
+        filenames = np.char.add(np.char.zfill(np.arange(num_files).astype(str), 8), suffix)
+        return SettingsIndex(self.header(di_file), filenames, sweep_names, columns, values,
+                             self.ranges(columns))
+
+
+    def ranges(self, columns: Sequence[str]) -> np.ndarray:
+        """
+        The (min, max) of each column over the config's full sweep grids and
+        its default, NaN for a column that has neither
+        """
+        defaults = self.config.default_values()
+        ranges = np.full((len(columns), 2), np.nan)
+        for j, c in enumerate(columns):
+            # A column takes its values from the first ParamSweep naming it (see Sweep)
+            sources = [next((p for p in sw.params if c in p.names), None) for sw in self.config.infos]
+            values = [v for p in sources if p is not None for v in p.values()]
+            values += [defaults[c]] if c in defaults else []
+            if values:
+                ranges[j] = min(values), max(values)
+        return ranges
+
+
+    def write(self, out_file: Path, di_file: Path, suffix: str='.wav'):
+        """
+        Writes the settings index, as settings.yaml or, depending on the
+        suffix of out_file, as a columnar .npz or .parquet index.  The
+        clip filenames end in suffix.
+        """
+        if out_file.suffix != '.yaml':
+            write_index(out_file, self.index(di_file, suffix))
+            return
         with open(out_file, "w") as settings_file:
-            settings_file.write(f"brand: {self.config.brand_name}\n")
-            settings_file.write(f"vst_name: {self.config.vst_name}\n")
-            settings_file.write(f"device: {self.config.device_name}\n")                    
-            settings_file.write(f"device_type: {self.config.device_type}\n")                    
-            settings_file.write(f"data_type: {self.config.data_type}\n")                    
-            settings_file.write(f"di_file: {di_file.name}\n")
+            for key, value in self.header(di_file).items():
+                settings_file.write(f"{key}: {value}\n")
             settings_file.write("files:\n")
             i = 0
             for sweep_name, sweep in self.sweeps:
-                for setting in sweep:
-                    settings_file.write(f"  - filename: {i:08d}.wav\n" +
+                for row in sweep.table.tolist():
+                    settings_file.write(f"  - filename: {i:08d}{suffix}\n" +
                                         "    settings:\n")
-                    for param_name, param_val in setting.items():
+                    for param_name, param_val in zip(sweep.columns, row):
                         settings_file.write(f"    - \"{param_name}\": {param_val}\n")
                     i += 1
             settings_file.write("defaults:\n")
@@ -0,0 +1,109 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils import write_atomic
+
+# Per-stage totals exported to the Prometheus textfile
+PROM_FIELDS = ('settings', 'audio_seconds', 'wall_s', 'bytes_written')
+
+
+class Telemetry:
+    """
+    Structured timing and throughput events for the stages of a render
+    (render, split, link, index).
+
+    Each event records the stage, its unit of work and sweep, the number
+    of settings and seconds of audio it handled, its wall time, realtime
+    factor (audio seconds per wall second) and the bytes it wrote.  Events
+    are appended to a JSON-lines file, and per-stage totals are kept in a
+    Prometheus textfile, if given.  With collect=True, events are also kept
+    in memory, so a pool worker can hand them back to the main process.
+    """
+
+    def __init__(self, jsonl_file: Optional[Path]=None, prom_file: Optional[Path]=None, collect: bool=False):
+        self.jsonl_file = jsonl_file
+        self.prom_file = prom_file
+        self.collect = collect
+        self.collected: List[Dict] = []
+        self.totals: Dict[str, Dict[str, float]] = dict()
+        self.lock = threading.Lock()
+        if jsonl_file is not None:
+            jsonl_file.parent.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def stage(self, stage: str, unit: Optional[str]=None, sweep: Optional[str]=None,
+              settings: int=0, audio_seconds: float=0.0):
+        """
+        Times the body of the with block as one event of the stage.  The
+        body may fill in event['bytes_written'] and any extra fields.
+        """
+        event = {'stage': stage, 'unit': unit, 'sweep': sweep, 'settings': settings,
+                 'audio_seconds': audio_seconds, 'bytes_written': 0}
+        start = time.perf_counter()
+        yield event
+        event['wall_s'] = time.perf_counter() - start
+        self.emit(event)
+
+    def emit(self, event: Dict) -> None:
+        event.setdefault('time', time.time())
+        if event.get('wall_s') and event.get('audio_seconds'):
+            event.setdefault('realtime_factor', event['audio_seconds'] / event['wall_s'])
+        with self.lock:
+            totals = self.totals.setdefault(event['stage'], dict.fromkeys(('events',) + PROM_FIELDS, 0))
+            totals['events'] += 1
+            for field in PROM_FIELDS:
+                totals[field] += event.get(field) or 0
+            if self.collect:
+                self.collected.append(event)
+            if self.jsonl_file is not None:
+                with open(self.jsonl_file, "a") as outfile:
+                    outfile.write(json.dumps(event) + "\n")
+            if self.prom_file is not None:
+                self.write_prometheus()
+
+    def write_prometheus(self) -> None:
+        lines = []
+        for field in ('events',) + PROM_FIELDS:
+            metric = f"tone_render_stage_{field}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for stage, totals in self.totals.items():
+                lines.append(f'{metric}{{stage="{stage}"}} {totals[field]}')
+        # The textfile collector never reads a partial file
+        text = "\n".join(lines) + "\n"
+        write_atomic(self.prom_file, lambda tmp_file: tmp_file.write_text(text))
+
+
+class RenderETA:
+    """
+    Estimates the time left in a run from the audio rendered so far and
+    the wall time it took, so it reflects the actual speed of the plugin
+    and machine (and the number of instances rendering in parallel)
+    """
+
+    def __init__(self, total_audio_seconds: float):
+        self.total = total_audio_seconds
+        self.done = 0.0
+        self.start = time.perf_counter()
+
+    def update(self, audio_seconds: float) -> None:
+        self.done += audio_seconds
+
+    @property
+    def speed(self) -> Optional[float]:
+        """
+        Seconds of audio rendered per wall second
+        """
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if self.done > 0 and elapsed > 0 else None
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """
+        Estimated wall seconds until all audio is rendered
+        """
+        speed = self.speed
+        return max(self.total - self.done, 0.0) / speed if speed else None
@@ -0,0 +1,96 @@
+import errno
+import os
+
+import numpy as np
+
+from cache_helpers import RenderCache, link_file, looped_di_file, prune_cache
+from encoding_helpers import ClipEncoding
+from index_helpers import SettingsIndex
+from wav_helpers import WAVE_FORMAT_PCM, make_fmt_chunk, write_wav_header
+
+
+def test_prune_cache_evicts_least_recently_used(tmp_path):
+    for i, name in enumerate(["a.wav", "b.wav", "c.wav"]):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (i, i))
+    (tmp_path / "other.txt").write_bytes(b"x" * 1000)
+    prune_cache(tmp_path, 150, keep=tmp_path / "a.wav")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.wav", "other.txt"]
+
+
+def test_uncached_looped_di_keeps_only_the_latest(tmp_path):
+    di_file = tmp_path / "di.wav"
+    fmt_chunk = make_fmt_chunk(WAVE_FORMAT_PCM, 1, 10, 16)
+    with open(di_file, "wb") as f:
+        write_wav_header(f, fmt_chunk, 6)
+        f.write(np.array([0, 1, 2], dtype='<i2').tobytes())
+    cache_dir = tmp_path / "cache"
+    first = looped_di_file(di_file, 2, 0.1, cache_dir, max_bytes=0)
+    second = looped_di_file(di_file, 3, 0.1, cache_dir, max_bytes=0)
+    assert second.is_file() and not first.exists()
+    assert looped_di_file(di_file, 3, 0.1, cache_dir) == second
+
+
+def settings_index(columns, values):
+    values = np.array(values, dtype=np.float64)
+    filenames = np.array([f"{i:08d}.wav" for i in range(len(values))])
+    return SettingsIndex({}, filenames, np.full(len(values), "sweep"), columns, values)
+
+
+def render_cache(cache_dir=None, encoding=None):
+    return RenderCache(cache_dir, "Amp", {'Gain': 0.5, 'Drive': 0.1}, "abc", 0.1, 44100, encoding)
+
+
+def test_cache_keys_are_stable():
+    # Keys of existing caches must never change
+    keys = render_cache().keys(settings_index(['Gain', 'Drive'], [[0.5, 0.25]]))
+    assert keys == ['e9ca233e882db2ad56a71a566b59377d30621394']
+    assert render_cache(encoding=ClipEncoding()).keys(settings_index(['Gain', 'Drive'], [[0.5, 0.25]])) == keys
+
+
+def test_cache_keys_ignore_column_order():
+    a = render_cache().keys(settings_index(['Gain', 'Drive'], [[0.5, 0.25], [0.1, 0.2]]))
+    b = render_cache().keys(settings_index(['Drive', 'Gain'], [[0.25, 0.5], [0.2, 0.1]]))
+    assert a == b and a[0] != a[1]
+
+
+def test_cache_keys_depend_on_the_encoding():
+    index = settings_index(['Gain'], [[0.5]])
+    keys = {tuple(render_cache(encoding=encoding).keys(index))
+            for encoding in (ClipEncoding(), ClipEncoding('raw'), ClipEncoding('wav', 'pcm16'),
+                             ClipEncoding('wav', mono=True), ClipEncoding('wav', sample_rate=22050))}
+    assert len(keys) == 5
+
+
+def fill_cache(cache, output_dir, values):
+    keys = cache.keys(settings_index(['Gain'], values))
+    file_indices = range(len(values))
+    rendered = cache.missing(keys, file_indices, output_dir)
+    for i in rendered:
+        (output_dir / f"{i:08d}.wav").write_bytes(f"clip {values[i][0]}".encode())
+    cache.fill(keys, file_indices, rendered, output_dir)
+    return rendered
+
+
+def test_repeated_and_cached_settings_are_linked(tmp_path):
+    first, second, cache_dir = tmp_path / "first", tmp_path / "second", tmp_path / "cache"
+    first.mkdir()
+    second.mkdir()
+    # Within a run, only the first of repeated settings is rendered
+    assert fill_cache(render_cache(cache_dir), first, [[0.1], [0.2], [0.1]]) == [0, 1]
+    assert (first / "00000002.wav").read_bytes() == b"clip 0.1"
+    assert os.path.samefile(first / "00000000.wav", first / "00000002.wav")
+    # A later run only renders settings not in the cache
+    assert fill_cache(render_cache(cache_dir), second, [[0.2], [0.3]]) == [1]
+    assert os.path.samefile(second / "00000000.wav", first / "00000001.wav")
+
+
+def test_link_falls_back_to_a_copy(tmp_path, monkeypatch):
+    def cross_device_link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(os, "link", cross_device_link)
+    (tmp_path / "src.wav").write_bytes(b"clip")
+    (tmp_path / "dst.wav").write_bytes(b"old")
+    link_file(tmp_path / "src.wav", tmp_path / "dst.wav")
+    assert (tmp_path / "dst.wav").read_bytes() == b"clip"
+    assert not os.path.samefile(tmp_path / "src.wav", tmp_path / "dst.wav")
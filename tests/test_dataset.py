@@ -0,0 +1,102 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from dataset import RenderedDataset
+from index_helpers import load_index, write_index
+from wav_helpers import WAVE_FORMAT_PCM, make_fmt_chunk, write_wav_header
+
+REPO = Path(__file__).resolve().parent.parent
+
+CONFIG = """brand: Test
+vst: Test FX
+device: Test 1
+device_type: Synthetic
+data_type: Simulation
+sweeps:
+- comment: Test
+  params:
+  - name:
+    - Param 1
+    min: 0.0
+    max: 0.3
+    step: 0.1
+defaults:
+- name: Param 1
+  value: 0.5
+"""
+
+
+def render(tmp_path: Path, *flags: str) -> Path:
+    """
+    Renders the test sweep with the offline backend, returning the directory of its index
+    """
+    tmp_path.mkdir(exist_ok=True)
+    di_file = tmp_path / "di.wav"
+    samples = (np.sin(np.arange(2205) / 10.0) * 16000).astype('<i2')
+    with open(di_file, "wb") as f:
+        write_wav_header(f, make_fmt_chunk(WAVE_FORMAT_PCM, 1, 22050, 16), samples.nbytes)
+        f.write(samples.tobytes())
+    conf_file = tmp_path / "config.yaml"
+    conf_file.write_text(CONFIG)
+    subprocess.run([sys.executable, str(REPO / "render_data.py"), "--backend", "offline",
+                    "--di_file", str(di_file), "--conf_file", str(conf_file),
+                    "--output_dir", str(tmp_path / "output"), "--reaper_dir", str(tmp_path / "reaper"),
+                    "--warmup_time", "0", "--index_format", "npz", *flags],
+                   cwd=REPO, check=True, capture_output=True)
+    return next((tmp_path / "output").rglob("settings.npz")).parent
+
+
+def test_reads_wav_run(tmp_path):
+    pytest.importorskip("reapy")
+    data = RenderedDataset(render(tmp_path))
+    di, audio, params = data[0:4]
+    assert audio.shape == (4, 2205, 1) and audio.dtype == np.int16
+    # Param 1 spans 0..0.5 in the config: swept over 0..0.3, with a default of 0.5
+    np.testing.assert_allclose(params[:, 0], [0.0, 0.2, 0.4, 0.6], rtol=1e-6)
+
+
+def test_normalizes_over_index_values_without_ranges(tmp_path):
+    pytest.importorskip("reapy")
+    output_dir = render(tmp_path)
+    index = load_index(output_dir / "settings.npz")
+    index.ranges = None
+    write_index(output_dir / "settings.npz", index)
+    params = RenderedDataset(output_dir).params
+    np.testing.assert_allclose(params[:, 0], [0.0, 1 / 3, 2 / 3, 1.0], rtol=1e-6)
+
+
+def test_empty_batches(tmp_path):
+    pytest.importorskip("reapy")
+    for data in (RenderedDataset(render(tmp_path / "files")),
+                 RenderedDataset(render(tmp_path / "shards", "--shard_size_mb", "1"))):
+        for key in (slice(2, 2), [], np.zeros(len(data), dtype=bool)):
+            di, audio, params = data[key]
+            assert di.shape == (0, 2205, 1)
+            assert audio.shape == (0, 2205, 1) and audio.dtype == np.int16
+            assert params.shape == (0, 1)
+
+
+def test_shards_read_like_files(tmp_path):
+    pytest.importorskip("reapy")
+    files = RenderedDataset(render(tmp_path / "files"))
+    shards = RenderedDataset(render(tmp_path / "shards", "--shard_size_mb", "1"))
+    assert shards.shards is not None
+    np.testing.assert_array_equal(shards[0:4][1], files[0:4][1])
+    np.testing.assert_array_equal(shards[[3, 1]][1], files[[3, 1]][1])
+
+
+def test_reads_flac_run(tmp_path):
+    pytest.importorskip("reapy")
+    pytest.importorskip("soundfile")
+    wav = RenderedDataset(render(tmp_path / "wav"))
+    flac = RenderedDataset(render(tmp_path / "flac", "--clip_codec", "flac"))
+    assert len(flac) == len(wav) == 4
+    di, audio, params = flac[0:4]
+    assert audio.shape == (4, 2205, 1) and audio.dtype == np.float32
+    # 16-bit FLAC is lossless, so it decodes to the same samples as the WAV clips
+    np.testing.assert_array_equal(audio, wav[0:4][1] * wav.audio_scale)
+    np.testing.assert_array_equal(params, wav.params)
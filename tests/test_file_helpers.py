@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from file_helpers import ClipWriter
+
+
+def fail():
+    raise OSError("disk full")
+
+
+def test_write_errors_are_raised_on_close():
+    with pytest.raises(OSError, match="disk full"):
+        with ClipWriter(num_workers=2) as writer:
+            writer.submit(fail)
+
+
+def test_write_errors_do_not_mask_the_reader_error():
+    with pytest.raises(ValueError, match="bad render"):
+        with ClipWriter(num_workers=2) as writer:
+            writer.submit(fail)
+            time.sleep(0.1)
+            raise ValueError("bad render")
+
+
+def test_pending_writes_are_bounded():
+    lock = threading.Lock()
+    running = []
+    peak = []
+    release = threading.Event()
+
+    def write():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        release.wait(5)
+        with lock:
+            running.pop()
+
+    writer = ClipWriter(num_workers=2, max_pending=3)
+    submitted = []
+    thread = threading.Thread(target=lambda: [submitted.append(writer.submit(write)) for _ in range(10)])
+    thread.start()
+    time.sleep(0.2)
+    # The reader blocks once max_pending writes are in flight
+    assert len(submitted) == 3
+    release.set()
+    thread.join(5)
+    writer.close()
+    assert len(submitted) == 10 and max(peak) <= 2
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from index_helpers import SettingsIndex, find_indexes, load_index, write_index
+
+
+def make_index(ranges=True):
+    values = np.array([[0.5, 0.1, np.nan], [0.5, 0.2, 0.7], [0.25, 0.3, np.nan]])
+    return SettingsIndex({'brand': "Test", 'di_file': "di.wav", 'seed': "7"},
+                         np.array(["00000000.wav", "00000001.wav", "00000002.wav"]),
+                         np.array(["sweep a", "sweep a", "sweep b"]),
+                         ["Gain", "Drive", "Tone"], values,
+                         np.array([[0.25, 0.5], [0.1, 0.3], [0.7, 0.7]]) if ranges else None)
+
+
+@pytest.mark.parametrize("suffix", [".npz", ".parquet"])
+@pytest.mark.parametrize("ranges", [True, False])
+def test_round_trip(tmp_path, suffix, ranges):
+    if suffix == ".parquet":
+        pytest.importorskip("pyarrow")
+    index = make_index(ranges)
+    write_index(tmp_path / f"settings{suffix}", index)
+    loaded = load_index(tmp_path / f"settings{suffix}")
+    assert loaded.meta == index.meta
+    assert loaded.filenames.tolist() == index.filenames.tolist()
+    assert loaded.sweeps.tolist() == index.sweeps.tolist()
+    assert loaded.columns == index.columns
+    np.testing.assert_array_equal(loaded.values, index.values)
+    if ranges:
+        np.testing.assert_array_equal(loaded.ranges, index.ranges)
+    else:
+        assert loaded.ranges is None
+    assert list(loaded.rows()) == list(index.rows())
+
+
+def test_rows_skip_missing_parameters():
+    rows = list(make_index().rows())
+    assert rows[0] == {'brand': "Test", 'di_file': "di.wav", 'seed': "7",
+                       'filename': "00000000.wav", 'Gain': 0.5, 'Drive': 0.1}
+    assert rows[1]['Tone'] == 0.7
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_index(tmp_path / "settings.csv", make_index())
+    with pytest.raises(ValueError):
+        load_index(tmp_path / "settings.csv")
+
+
+def test_find_indexes_prefers_binary_indexes(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    for name in ("a/settings.yaml", "a/settings.npz", "b/settings.yaml"):
+        (tmp_path / name).write_text("")
+    assert find_indexes(tmp_path) == [tmp_path / "a" / "settings.npz", tmp_path / "b" / "settings.yaml"]
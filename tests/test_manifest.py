@@ -0,0 +1,44 @@
+import json
+
+from manifest import RenderManifest
+
+
+def write_clips(output_dir, start, stop):
+    for i in range(start, stop):
+        (output_dir / f"{i:08d}.wav").write_bytes(b"x" * (100 + i))
+
+
+def test_resumes_completed_units(tmp_path):
+    write_clips(tmp_path, 0, 4)
+    manifest = RenderManifest(tmp_path / "manifest.json", "key")
+    manifest.complete("sweep-0", 0, 4, "abc", tmp_path)
+    resumed = RenderManifest(tmp_path / "manifest.json", "key")
+    assert resumed.is_done("sweep-0", 0, 4, tmp_path)
+    assert not resumed.is_done("sweep-0", 0, 3, tmp_path)
+    assert not resumed.is_done("sweep-1", 4, 8, tmp_path)
+
+
+def test_discards_progress_of_another_run(tmp_path):
+    write_clips(tmp_path, 0, 4)
+    RenderManifest(tmp_path / "manifest.json", "key").complete("sweep-0", 0, 4, "abc", tmp_path)
+    assert not RenderManifest(tmp_path / "manifest.json", "other").is_done("sweep-0", 0, 4, tmp_path)
+
+
+def test_rerenders_missing_or_truncated_clips(tmp_path):
+    write_clips(tmp_path, 0, 4)
+    RenderManifest(tmp_path / "manifest.json", "key").complete("sweep-0", 0, 4, "abc", tmp_path)
+    with open(tmp_path / "00000002.wav", "r+b") as f:
+        f.truncate(10)
+    assert not RenderManifest(tmp_path / "manifest.json", "key").is_done("sweep-0", 0, 4, tmp_path)
+    write_clips(tmp_path, 0, 4)
+    (tmp_path / "00000001.wav").unlink()
+    assert not RenderManifest(tmp_path / "manifest.json", "key").is_done("sweep-0", 0, 4, tmp_path)
+
+
+def test_manifests_without_sizes_check_existence(tmp_path):
+    write_clips(tmp_path, 0, 2)
+    (tmp_path / "manifest.json").write_text(json.dumps(
+        {'run_key': "key", 'seed': 1, 'units': {"sweep-0": {'start': 0, 'stop': 2, 'checksum': "abc"}}}))
+    assert RenderManifest(tmp_path / "manifest.json", "key").is_done("sweep-0", 0, 2, tmp_path)
+    (tmp_path / "00000001.wav").unlink()
+    assert not RenderManifest(tmp_path / "manifest.json", "key").is_done("sweep-0", 0, 2, tmp_path)
@@ -0,0 +1,33 @@
+import pytest
+
+from shard_helpers import ShardIndex, ShardWriter
+
+
+def test_packs_clips_into_indexed_shards(tmp_path):
+    with ShardWriter(tmp_path, shard_bytes=10) as writer:
+        for i in range(5):
+            writer.add(i, bytes([i]) * 4)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "shard-00000000.bin", "shard-00000000.npz", "shard-00000002.bin", "shard-00000002.npz",
+        "shard-00000004.bin", "shard-00000004.npz"]
+    index = ShardIndex.scan(tmp_path)
+    index.write(tmp_path)
+    loaded = ShardIndex.load(tmp_path)
+    assert loaded.file_index.tolist() == list(range(5))
+    assert loaded.covers(0, 5) and not loaded.covers(0, 6)
+    for i, entry in enumerate(loaded.locate(range(5)).tolist()):
+        data = (tmp_path / str(loaded.shard[entry])).read_bytes()
+        start = loaded.offset[entry]
+        assert data[start:start + loaded.length[entry]] == bytes([i]) * 4
+
+
+def test_failed_shard_leaves_no_partial_files(tmp_path):
+    with pytest.raises(RuntimeError):
+        with ShardWriter(tmp_path, shard_bytes=10) as writer:
+            for i in range(3):
+                writer.add(i, bytes([i]) * 4)
+            writer.drain(0)
+            raise RuntimeError("render failed")
+    # The full first shard is kept, the partial second one is deleted
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["shard-00000000.bin", "shard-00000000.npz"]
+    assert ShardIndex.scan(tmp_path).file_index.tolist() == [0, 1]
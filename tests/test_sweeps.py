@@ -0,0 +1,103 @@
+import itertools
+from random import Random
+
+import pytest
+
+from sweeps import ParamSweep, Sweep, grid_strata, unit_samples
+
+
+def reference_settings(params):
+    """
+    The settings in the order of the original recursive sweep generator:
+    the first param varies fastest, and the first param naming a column wins
+    """
+    if not params:
+        yield {}
+        return
+    first, rest = params[0], params[1:]
+    for setting in reference_settings(rest):
+        for v in first.values():
+            yield {**setting, **{pname: v for pname in first.names}}
+
+
+@pytest.fixture
+def params():
+    return [ParamSweep(["Gain"], 0.0, 0.2, 0.1),
+            ParamSweep(["Bass", "Mid"], 0.0, 0.3, 0.1),
+            ParamSweep(["Treble"], 0.5, 0.6, 0.1),
+            ParamSweep(["Mid"], 0.9, 1.0, 0.1)]
+
+
+def row(setting, columns):
+    return [setting[c] for c in columns]
+
+
+def test_decode_matches_product_order(params):
+    sweep = Sweep(params)
+    grids = [p.values() for p in params]
+    # itertools.product varies its last iterable fastest, so feed the params in reverse
+    expected = [tuple(reversed(values)) for values in itertools.product(*reversed(grids))]
+    assert len(sweep) == len(expected) == 3 * 4 * 2 * 2
+    for k, values in enumerate(expected):
+        setting = sweep.setting(k)
+        for param, value in zip(params, values):
+            for pname in param.names:
+                # A column tied to several params takes the first param's value
+                if next(p for p in params if pname in p.names) is param:
+                    assert setting[pname] == value
+
+
+def test_settings_match_recursive_generator(params):
+    sweep = Sweep(params)
+    expected = list(reference_settings(params))
+    assert list(sweep) == expected
+    # Including key order, which sets the order of settings.yaml entries
+    assert [list(s.keys()) for s in sweep] == [list(s.keys()) for s in expected]
+
+
+def test_table_matches_settings(params):
+    sweep = Sweep(params)
+    assert sweep.table.shape == (len(sweep), len(sweep.columns))
+    assert sweep.table.tolist() == [row(s, sweep.columns) for s in reference_settings(params)]
+
+
+@pytest.mark.parametrize("view", [slice(5, 30), slice(3, None, 7), slice(None, None, -1), slice(40, 48)])
+def test_table_of_slices(params, view):
+    sweep = Sweep(params)
+    part = sweep[view]
+    assert len(part) == len(range(len(sweep))[view])
+    assert part.table.tolist() == [row(part[k], sweep.columns) for k in range(len(part))]
+    assert part.table.tolist() == sweep.table[view].tolist()
+
+
+def test_table_of_take_and_nested_views(params):
+    sweep = Sweep(params)
+    positions = [47, 0, 13, 13, 2]
+    taken = sweep.take(positions)
+    assert taken.table.tolist() == [row(sweep.setting(p), sweep.columns) for p in positions]
+    nested = sweep[10:40].take([0, 29, 7])
+    assert nested.table.tolist() == sweep.table[[10, 39, 17]].tolist()
+    assert nested[1] == sweep.setting(39)
+
+
+def test_table_of_samples(params):
+    sweep = Sweep(params)
+    for method in ('uniform', 'lhs', 'stratified'):
+        sampled = sweep.sample(10, Random(0), method)
+        assert len(set(sampled.indices)) == 10
+        assert sampled.table.tolist() == [row(s, sweep.columns) for s in sampled]
+
+
+@pytest.mark.parametrize("k, dims, strata", [(10, 2, [3, 3]), (12, 2, [4, 3]), (5, 4, [2, 2, 1, 1])])
+def test_stratified_fills_every_cell(k, dims, strata):
+    assert grid_strata(k, dims).tolist() == strata
+    points = unit_samples('stratified', k, dims, seed=0)
+    assert points.shape == (k, dims)
+    cells = {tuple(int(x * n) for x, n in zip(point, strata)) for point in points.tolist()}
+    assert cells == set(itertools.product(*(range(n) for n in strata)))
+
+
+def test_empty_view(params):
+    part = Sweep(params)[5:5]
+    assert len(part) == 0
+    assert part.table.shape == (0, len(part.columns))
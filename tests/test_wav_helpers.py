@@ -0,0 +1,148 @@
+import struct
+
+import numpy as np
+import pytest
+
+from wav_helpers import (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_EXTENSIBLE,
+                         make_fmt_chunk, read_wav_info, read_wav_frames, decode_frames,
+                         encode_frames, sample_format, write_wav_header, tile_wav)
+
+
+def chunk(chunk_id: bytes, body: bytes) -> bytes:
+    return struct.pack('<4sI', chunk_id, len(body)) + body + b'\x00' * (len(body) % 2)
+
+
+def riff(chunks: bytes, riff_id: bytes=b'RIFF') -> bytes:
+    return struct.pack('<4sI4s', riff_id, 4 + len(chunks), b'WAVE') + chunks
+
+
+def pcm16(samples) -> bytes:
+    return np.asarray(samples, dtype='<i2').tobytes()
+
+
+def test_reads_plain_pcm(tmp_path):
+    data = pcm16([0, 1000, -1000, 32767])
+    path = tmp_path / "plain.wav"
+    path.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 2, 44100, 16)) + chunk(b'data', data)))
+    info = read_wav_info(path)
+    assert (info.channels, info.sample_rate, info.bits_per_sample) == (2, 44100, 16)
+    assert info.n_frames == 2
+    assert path.read_bytes()[info.data_offset:info.data_offset + info.data_size] == data
+
+
+def test_skips_odd_sized_chunks(tmp_path):
+    # A 3-byte chunk is followed by a pad byte, which is not counted in its size
+    data = pcm16([1, 2, 3])
+    path = tmp_path / "odd.wav"
+    path.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 8000, 16)) +
+                          chunk(b'LIST', b'abc') + chunk(b'junk', b'x') + chunk(b'data', data)))
+    info = read_wav_info(path)
+    assert info.n_frames == 3
+    assert np.allclose(read_wav_frames(path)[:, 0], np.array([1, 2, 3]) / 32768)
+
+
+def test_odd_sized_data_chunk(tmp_path):
+    # 8-bit mono with an odd number of frames ends with a pad byte
+    path = tmp_path / "odd-data.wav"
+    path.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 8000, 8)) + chunk(b'data', b'\x80\xff\x00')))
+    info = read_wav_info(path)
+    assert info.data_size == 3
+    assert np.allclose(read_wav_frames(path)[:, 0], [0.0, 127 / 128, -1.0])
+
+
+def test_extensible_format(tmp_path):
+    # WAVE_FORMAT_EXTENSIBLE: cbSize, valid bits, channel mask and the subformat GUID
+    subformat = struct.pack('<H', WAVE_FORMAT_IEEE_FLOAT) + bytes.fromhex('000000001000800000aa00389b71')
+    fmt = (struct.pack('<HHIIHH', WAVE_FORMAT_EXTENSIBLE, 1, 48000, 48000 * 4, 4, 32) +
+           struct.pack('<HHI', 22, 32, 0x4) + subformat)
+    samples = np.array([0.5, -0.25, 0.125], dtype='<f4')
+    path = tmp_path / "extensible.wav"
+    path.write_bytes(riff(chunk(b'fmt ', fmt) + chunk(b'data', samples.tobytes())))
+    info = read_wav_info(path)
+    assert info.format_tag == WAVE_FORMAT_EXTENSIBLE
+    assert sample_format(info) == WAVE_FORMAT_IEEE_FLOAT
+    assert len(info.fmt_chunk) == 40
+    assert np.array_equal(read_wav_frames(path)[:, 0], samples)
+
+
+def test_rf64_ds64(tmp_path):
+    # RF64 keeps the real data size in ds64, with 0xFFFFFFFF in the data chunk
+    data = pcm16(range(10))
+    ds64 = struct.pack('<QQQI', 0, len(data), 10, 0)
+    body = (chunk(b'ds64', ds64) + chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 8000, 16)) +
+            struct.pack('<4sI', b'data', 0xFFFFFFFF) + data)
+    path = tmp_path / "rf64.wav"
+    path.write_bytes(struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE') + body)
+    info = read_wav_info(path)
+    assert info.data_size == len(data)
+    assert np.array_equal(np.round(read_wav_frames(path)[:, 0] * 32768), np.arange(10))
+
+
+def test_truncated_data_chunk(tmp_path):
+    # An interrupted render reports more data than the file holds
+    data = pcm16(range(6))
+    body = chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 2, 8000, 16)) + struct.pack('<4sI', b'data', 1000) + data
+    path = tmp_path / "truncated.wav"
+    path.write_bytes(riff(body))
+    info = read_wav_info(path)
+    assert info.data_size == len(data)
+    assert info.n_frames == 3
+    assert read_wav_frames(path).shape == (3, 2)
+
+
+def test_rejects_non_wav_and_missing_chunks(tmp_path):
+    path = tmp_path / "bad.wav"
+    path.write_bytes(b'OggS' + bytes(40))
+    with pytest.raises(ValueError):
+        read_wav_info(path)
+    path.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 8000, 16))))
+    with pytest.raises(ValueError):
+        read_wav_info(path)
+    path.write_bytes(riff(chunk(b'data', pcm16([1])) + chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 8000, 16))))
+    with pytest.raises(ValueError):
+        read_wav_info(path)
+
+
+@pytest.mark.parametrize("tag, bits", [(WAVE_FORMAT_PCM, 8), (WAVE_FORMAT_PCM, 16), (WAVE_FORMAT_PCM, 24),
+                                       (WAVE_FORMAT_PCM, 32), (WAVE_FORMAT_IEEE_FLOAT, 32),
+                                       (WAVE_FORMAT_IEEE_FLOAT, 64)])
+def test_decode_encode_round_trip(tmp_path, tag, bits):
+    path = tmp_path / "fmt.wav"
+    path.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(tag, 2, 8000, bits)) + chunk(b'data', b'')))
+    info = read_wav_info(path)
+    frames = np.array([[0.0, 0.5], [-0.5, -1.0], [0.25, 0.75]], dtype=np.float32)
+    decoded = decode_frames(encode_frames(frames, info), info)
+    assert decoded.shape == (3, 2)
+    assert np.allclose(decoded, frames, atol=2.0 ** (1 - bits))
+
+
+def test_writes_rf64_past_4_gib(tmp_path):
+    # A sparse file: only the header is actually written
+    data_size = 5 << 30
+    path = tmp_path / "large.wav"
+    with open(path, "wb") as out:
+        write_wav_header(out, make_fmt_chunk(WAVE_FORMAT_PCM, 1, 44100, 16), data_size)
+        out.truncate(out.tell() + data_size)
+    with open(path, "rb") as f:
+        assert f.read(4) == b"RF64"
+    info = read_wav_info(path)
+    assert info.data_size == data_size
+    assert info.n_frames == data_size // 2
+
+
+def test_small_files_keep_a_riff_header(tmp_path):
+    path = tmp_path / "small.wav"
+    with open(path, "wb") as out:
+        write_wav_header(out, make_fmt_chunk(WAVE_FORMAT_PCM, 1, 44100, 16), 4)
+        out.write(pcm16([1, 2]))
+    assert path.read_bytes()[:4] == b'RIFF'
+    assert read_wav_info(path).data_size == 4
+
+
+def test_tile_wav_layout(tmp_path):
+    di = tmp_path / "di.wav"
+    di.write_bytes(riff(chunk(b'fmt ', make_fmt_chunk(WAVE_FORMAT_PCM, 1, 10, 16)) + chunk(b'data', pcm16([1, 2, 3]))))
+    tiled = tmp_path / "tiled.wav"
+    tile_wav(di, tiled, 3, 0.2)
+    samples = np.round(read_wav_frames(tiled)[:, 0] * 32768).astype(int).tolist()
+    assert samples == [0, 0, 1, 2, 3] * 3
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from worker_pool import InstancePool, current_instance
+
+
+def connect_ok(port, render_dir):
+    pass
+
+
+def connect_fails_on_2(port, render_dir):
+    if port == 2:
+        raise ConnectionError("no instance")
+
+
+def connect_fails(port, render_dir):
+    raise ConnectionError("no instance")
+
+
+def connect_hangs(port, render_dir):
+    time.sleep(60)
+
+
+def instance_port(_):
+    return current_instance()['port']
+
+
+def test_runs_jobs_on_every_instance(tmp_path):
+    with InstancePool([1, 2], tmp_path, connect_ok) as pool:
+        ports = list(pool.imap(instance_port, range(20)))
+    assert set(ports) <= {1, 2}
+    assert (tmp_path / "instance-1").is_dir() and (tmp_path / "instance-2").is_dir()
+
+
+@pytest.mark.parametrize("connect", [connect_fails, connect_fails_on_2])
+def test_connect_failure_is_raised(tmp_path, connect):
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match="port 2"):
+        InstancePool([1, 2, 3], tmp_path, connect, connect_timeout=30)
+    assert time.perf_counter() - start < 30
+
+
+def test_connect_timeout(tmp_path):
+    with pytest.raises(RuntimeError, match="within"):
+        InstancePool([1], tmp_path, connect_hangs, connect_timeout=1)
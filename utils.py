@@ -1,3 +1,10 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+
 
 
 def seconds_to_str(total_seconds):
@@ -43,3 +50,29 @@ def byte_to_str(B):
         return '{0:.2f} GB'.format(B / GB)
     elif TB <= B:
         return '{0:.2f} TB'.format(B / TB)
+
+
+@contextmanager
+def atomic_file(path: Path) -> Iterator[Path]:
+    """
+    Yields a temporary file next to path to write, and renames it into
+    place on exit, so concurrent readers never see a partial file.  If
+    the block raises, the temporary file is deleted instead.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(prefix=path.stem, suffix=".tmp", dir=path.parent)
+    os.close(fd)
+    try:
+        yield Path(tmp_file)
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+
+def write_atomic(path: Path, write: Callable[[Path], object]) -> None:
+    """
+    Calls write on a temporary file next to path, then renames it into place (see atomic_file)
+    """
+    with atomic_file(path) as tmp_file:
+        write(tmp_file)
@@ -0,0 +1,294 @@
+import struct
+from pathlib import Path
+from typing import BinaryIO, List
+
+import numpy as np
+
+# Size of the blocks used when copying sample data between files
+COPY_BLOCK_BYTES = 1 << 20
+
+
+class WavInfo:
+    """
+    Header information for a RIFF/RF64 .wav file, as needed to address
+    its sample data directly on disk.
+    """
+
+    def __init__(self, fmt_chunk: bytes, data_offset: int, data_size: int):
+        self.fmt_chunk = fmt_chunk
+        self.data_offset = data_offset
+        self.data_size = data_size
+        (self.format_tag,
+         self.channels,
+         self.sample_rate,
+         self.byte_rate,
+         self.block_align,
+         self.bits_per_sample) = struct.unpack('<HHIIHH', fmt_chunk[:16])
+
+    @property
+    def n_frames(self) -> int:
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.n_frames / self.sample_rate
+
+
+def read_wav_info(wav_file: Path) -> WavInfo:
+    """
+    Reads the chunk layout of a .wav file without loading its sample data
+
+    Args:
+            wav_file (Path): The .wav file to inspect
+
+    Returns:
+        WavInfo: the format chunk and location of the sample data
+    """
+    file_size = Path(wav_file).stat().st_size
+    with open(wav_file, "rb") as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+            raise ValueError(f"{wav_file} is not a RIFF/RF64 .wav file")
+        fmt_chunk = None
+        large_data_size = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk found in {wav_file}")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'ds64':
+                # RF64 files keep the real 64-bit sizes here
+                _, large_data_size = struct.unpack('<QQ', f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size % 2), 1)
+            elif chunk_id == b'fmt ':
+                fmt_chunk = f.read(chunk_size)
+                f.seek(chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                if fmt_chunk is None:
+                    raise ValueError(f"Data chunk precedes format chunk in {wav_file}")
+                data_offset = f.tell()
+                if chunk_size == 0xFFFFFFFF and large_data_size is not None:
+                    chunk_size = large_data_size
+                # Renders that were interrupted may report more data than was written
+                data_size = min(chunk_size, file_size - data_offset)
+                return WavInfo(fmt_chunk, data_offset, data_size)
+            else:
+                f.seek(chunk_size + (chunk_size % 2), 1)
+
+
+def write_wav_header(out: BinaryIO, fmt_chunk: bytes, data_size: int) -> None:
+    """
+    Writes a RIFF header, format chunk and data chunk header to a stream.
+    Files of 4 GiB or more get an RF64 header instead, with the real sizes
+    in a ds64 chunk.
+
+    Args:
+            out (BinaryIO): The stream to write to, positioned at its start
+            fmt_chunk (bytes): The raw contents of the format chunk
+            data_size (int): The number of bytes of sample data that will follow
+                             (the caller pads odd sizes with a trailing zero byte)
+
+    Returns:
+        None
+    """
+    riff_size = 4 + (8 + len(fmt_chunk)) + (8 + data_size + data_size % 2)
+    if riff_size < 0xFFFFFFFF:
+        out.write(struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE'))
+    else:
+        block_align = struct.unpack('<H', fmt_chunk[12:14])[0]
+        out.write(struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE'))
+        out.write(struct.pack('<4sIQQQI', b'ds64', 28, riff_size + 36, data_size, data_size // block_align, 0))
+        data_size = 0xFFFFFFFF
+    out.write(struct.pack('<4sI', b'fmt ', len(fmt_chunk)))
+    out.write(fmt_chunk)
+    out.write(struct.pack('<4sI', b'data', data_size))
+
+
+def tile_wav(wav_file: Path, out_file: Path, times: int, margin: float) -> None:
+    """
+    Writes wav_file repeated times times, each repetition preceded by margin
+    seconds of silence, as REAPER would lay it out on a track.  Repetition i
+    starts at frame round((i * (duration + margin) + margin) * sample_rate),
+    matching the envelope timeline and the clip boundaries used to split.
+
+    Args:
+            wav_file (Path): The .wav file to repeat
+            out_file (Path): The .wav file to write
+            times (int): Number of repetitions
+            margin (float): Seconds of silence before each repetition
+
+    Returns:
+        None
+    """
+    info = read_wav_info(wav_file)
+    with open(wav_file, "rb") as f:
+        f.seek(info.data_offset)
+        data = f.read(info.n_frames * info.block_align)
+    period = info.duration + margin
+    # Rounding may put the end of the last repetition a frame past times * period
+    n_frames = max(round(times * period * info.sample_rate),
+                   round(((times - 1) * period + margin) * info.sample_rate) + info.n_frames if times else 0)
+    silence = bytes((round(margin * info.sample_rate) + 1) * info.block_align)
+    # Unsigned 8-bit PCM is silent at its midpoint
+    if sample_format(info) == WAVE_FORMAT_PCM and info.bits_per_sample == 8:
+        silence = b'\x80' * len(silence)
+    with open(out_file, "wb", buffering=COPY_BLOCK_BYTES) as out:
+        write_wav_header(out, info.fmt_chunk, n_frames * info.block_align)
+        written = 0
+        for i in range(times):
+            start = max(round((i * period + margin) * info.sample_rate), written)
+            frames = min(info.n_frames, n_frames - start)
+            write_silence(out, silence, (start - written) * info.block_align)
+            out.write(data[:max(frames, 0) * info.block_align])
+            written = start + max(frames, 0)
+        write_silence(out, silence, (n_frames - written) * info.block_align)
+        if (n_frames * info.block_align) % 2:
+            out.write(b'\x00')
+
+
+def concat_wavs(wav_files: List[Path], out_file: Path, margin: float) -> List[int]:
+    """
+    Writes the given .wav files back to back, each preceded by
+    round(margin * sample_rate) frames of silence.  All files must share
+    one sample format, channel count and sample rate.
+
+    Args:
+            wav_files (List[Path]): The .wav files to concatenate
+            out_file (Path): The .wav file to write
+            margin (float): Seconds of silence before each file
+
+    Returns:
+        List[int]: the start frame of each file's segment (its margin) in out_file
+    """
+    infos = [read_wav_info(f) for f in wav_files]
+    starts = segment_starts(infos, margin)
+    for wav_file, info in zip(wav_files, infos):
+        if info.fmt_chunk[:16] != infos[0].fmt_chunk[:16]:
+            raise ValueError(f"{wav_file} does not have the sample format of {wav_files[0]}")
+    silence = bytes(round(margin * infos[0].sample_rate) * infos[0].block_align)
+    if sample_format(infos[0]) == WAVE_FORMAT_PCM and infos[0].bits_per_sample == 8:
+        silence = b'\x80' * len(silence)
+    data_size = starts[-1] * infos[0].block_align
+    with open(out_file, "wb", buffering=COPY_BLOCK_BYTES) as out:
+        write_wav_header(out, infos[0].fmt_chunk, data_size)
+        for wav_file, info in zip(wav_files, infos):
+            out.write(silence)
+            with open(wav_file, "rb") as src:
+                src.seek(info.data_offset)
+                copy_bytes(src, out, info.n_frames * info.block_align)
+        if data_size % 2:
+            out.write(b'\x00')
+    return starts[:-1]
+
+
+def segment_starts(infos: List[WavInfo], margin: float) -> List[int]:
+    """
+    The start frame of each segment written by concat_wavs, followed by the total frame count
+    """
+    margin_frames = round(margin * infos[0].sample_rate)
+    starts = [0]
+    for info in infos:
+        starts.append(starts[-1] + margin_frames + info.n_frames)
+    return starts
+
+
+def write_silence(out: BinaryIO, silence: bytes, n_bytes: int) -> None:
+    """
+    Writes n_bytes of silence, given a block of silent frames to repeat
+    """
+    while n_bytes > 0:
+        out.write(silence[:n_bytes])
+        n_bytes -= min(n_bytes, len(silence))
+
+
+def copy_bytes(src: BinaryIO, dst: BinaryIO, n_bytes: int) -> None:
+    """
+    Copies n_bytes from the current position of src to dst in bounded blocks
+    """
+    while n_bytes > 0:
+        block = src.read(min(n_bytes, COPY_BLOCK_BYTES))
+        if not block:
+            break
+        dst.write(block)
+        n_bytes -= len(block)
+
+
+# Format tags of the sample encodings read and written as arrays
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def sample_format(info: WavInfo) -> int:
+    """
+    The format tag of the samples, looking through WAVE_FORMAT_EXTENSIBLE
+    """
+    if info.format_tag == WAVE_FORMAT_EXTENSIBLE and len(info.fmt_chunk) >= 26:
+        return struct.unpack('<H', info.fmt_chunk[24:26])[0]
+    return info.format_tag
+
+
+def make_fmt_chunk(format_tag: int, channels: int, sample_rate: int, bits_per_sample: int) -> bytes:
+    """
+    Builds a plain (non-extensible) format chunk
+    """
+    block_align = channels * bits_per_sample // 8
+    return struct.pack('<HHIIHH', format_tag, channels, sample_rate,
+                       sample_rate * block_align, block_align, bits_per_sample)
+
+
+def decode_frames(data: bytes, info: WavInfo) -> np.ndarray:
+    """
+    Decodes raw sample data in the format of info into float32 frames
+
+    Args:
+            data (bytes): Whole frames of sample data
+            info (WavInfo): The format of the data
+
+    Returns:
+        np.ndarray: a (frames, channels) float32 array in [-1, 1)
+    """
+    tag, bits = sample_format(info), info.bits_per_sample
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        samples = np.frombuffer(data, dtype=f'<f{bits // 8}').astype(np.float32)
+    elif tag == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        samples = np.frombuffer(data, dtype=f'<i{bits // 8}').astype(np.float32) / 2 ** (bits - 1)
+    elif tag == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8
+        samples = samples.astype(np.float32) / 2 ** 23
+    else:
+        raise ValueError(f"Unsupported sample format: tag {tag}, {bits} bits")
+    return samples.reshape(-1, info.channels)
+
+
+def encode_frames(frames: np.ndarray, info: WavInfo) -> bytes:
+    """
+    Encodes float frames in [-1, 1] as raw sample data in the format of info
+    """
+    tag, bits = sample_format(info), info.bits_per_sample
+    frames = np.asarray(frames, dtype=np.float32).reshape(-1)
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        return frames.astype(f'<f{bits // 8}').tobytes()
+    scale = 2 ** (bits - 1)
+    ints = np.clip(np.round(frames.astype(np.float64) * scale), -scale, scale - 1).astype(np.int64)
+    if tag == WAVE_FORMAT_PCM and bits == 8:
+        return (ints + 128).astype(np.uint8).tobytes()
+    if tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        return ints.astype(f'<i{bits // 8}').tobytes()
+    if tag == WAVE_FORMAT_PCM and bits == 24:
+        return ints.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    raise ValueError(f"Unsupported sample format: tag {tag}, {bits} bits")
+
+
+def read_wav_frames(wav_file: Path) -> np.ndarray:
+    """
+    Reads all sample data of a .wav file as (frames, channels) float32
+    """
+    info = read_wav_info(wav_file)
+    with open(wav_file, "rb") as f:
+        f.seek(info.data_offset)
+        data = f.read(info.n_frames * info.block_align)
+    return decode_frames(data, info)
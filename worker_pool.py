@@ -0,0 +1,98 @@
+import queue
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# How long a starting worker waits for an unclaimed port
+PORT_WAIT_SECONDS = 5
+
+# The instance of the current pool worker process, set by init_instance
+INSTANCE: Dict = dict()
+
+
+def init_instance(ports, statuses, render_root: Path, connect: Callable[[int, Path], None]) -> None:
+    """
+    Claims one of the instance ports for this worker process, creates its
+    render directory and connects to the instance, then reports the
+    outcome on statuses.  A failure is recorded rather than raised, since
+    the pool would replace a worker whose initializer raises with one that
+    has no port left to claim.
+    """
+    try:
+        # A short wait, as the ports may still be on their way through the queue
+        port = ports.get(timeout=PORT_WAIT_SECONDS)
+    except queue.Empty:
+        INSTANCE.update(error="No instance port left for a replacement pool worker")
+        statuses.put((None, INSTANCE['error']))
+        return
+    render_dir = render_root / f"instance-{port}"
+    INSTANCE.update(port=port, render_dir=render_dir)
+    try:
+        render_dir.mkdir(parents=True, exist_ok=True)
+        connect(port, render_dir)
+    except Exception as e:
+        INSTANCE['error'] = f"Connecting to the instance on port {port} failed: {e!r}"
+    statuses.put((port, INSTANCE.get('error')))
+
+
+def current_instance() -> Dict:
+    """
+    The port and render directory of the instance this worker drives
+    """
+    if 'error' in INSTANCE:
+        raise RuntimeError(INSTANCE['error'])
+    return INSTANCE
+
+
+class InstancePool:
+    """
+    A pool of worker processes, one per local render instance (e.g. a
+    REAPER instance listening on its own port).
+
+    Each worker connects to its instance once, with connect(port,
+    render_dir), and then pulls jobs from a shared queue whenever it is
+    idle, so fast instances take over the work of slow ones.  Results are
+    returned in job order, so callers can complete jobs sequentially.
+    connect must be a module-level function, so that it can be pickled.
+
+    The pool waits until every worker has connected (for at most
+    connect_timeout seconds), and raises a RuntimeError naming the
+    instances that could not be reached, rather than running without them.
+    """
+
+    def __init__(self, ports: List[int], render_root: Path, connect: Callable[[int, Path], None],
+                 connect_timeout: Optional[float]=300):
+        context = multiprocessing.get_context()
+        port_queue = context.Queue()
+        statuses = context.Queue()
+        for port in ports:
+            port_queue.put(port)
+        self.pool = context.Pool(processes=len(ports),
+                                 initializer=init_instance,
+                                 initargs=(port_queue, statuses, Path(render_root), connect))
+        errors = []
+        try:
+            for _ in ports:
+                port, error = statuses.get(timeout=connect_timeout)
+                if error is not None:
+                    errors.append(error)
+        except queue.Empty:
+            errors.append(f"Not every instance connected within {connect_timeout}s")
+        if errors:
+            self.pool.terminate()
+            self.pool.join()
+            raise RuntimeError("\n".join(errors))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+        self.pool.join()
+
+    def imap(self, fn: Callable, jobs: Iterable) -> Iterator:
+        # One job per dispatch, so idle workers always take the next job
+        return self.pool.imap(fn, jobs, chunksize=1)